@@ -1,20 +1,38 @@
-from Particles import app
 from Particles.models import simulation
-from Particles.controllers import sim_control
-from Particles.utils import Logger, Profiler
-import pyglet, time, cProfile
+from Particles.utils import Logger, Profiler, Transform
+from Particles.config import CONFIG
+import time
 
 
 def run_app(config=None):
 
+    if config is not None:
+        CONFIG.load(config)
+
+    # The window & controllers are only loaded for interactive sessions (see Particles.headless)
+    import pyglet
+    from Particles import app
+    from Particles.controllers import sim_control
+    win = app.create_window()
+
     # Setup model & controller
     sim = simulation.setup()
+    if "vectorized_forces" in CONFIG and CONFIG["vectorized_forces"]:
+        theta = None
+        if "barnes_hut_theta" in CONFIG:
+            theta = CONFIG["barnes_hut_theta"]
+        workers = 0
+        if "tick_workers" in CONFIG:
+            workers = CONFIG["tick_workers"]
+        sim.enable_force_engine(theta=theta, workers=workers)
+    if "neighbour_list_skin" in CONFIG and CONFIG["neighbour_list_skin"] is not None:
+        sim.enable_neighbour_lists(skin=CONFIG["neighbour_list_skin"])
     keyboard = pyglet.window.key.KeyStateHandler()
     controller = sim_control.SimController(sim, keyboard)
 
     # Add handlers
-    app.win.push_handlers(controller)
-    app.win.push_handlers(keyboard)
+    win.push_handlers(controller)
+    win.push_handlers(keyboard)
 
     # Profiling
     Profiler.make_profiler_category("draw_times")
@@ -22,46 +40,51 @@ def run_app(config=None):
 
     # Logger verbose level
     default_verbose = 3
-    if "verbose_level" in app.CONFIG:
-        default_verbose = app.CONFIG["verbose_level"]
+    if "verbose_level" in CONFIG:
+        default_verbose = CONFIG["verbose_level"]
     Logger.set_verbose_level(default_verbose)
 
     fps_counter = None
-    if "show_FPS" in app.CONFIG and app.CONFIG["show_FPS"]:
-        fps_counter = pyglet.window.FPSDisplay(app.win)
+    if "show_FPS" in CONFIG and CONFIG["show_FPS"]:
+        fps_counter = pyglet.window.FPSDisplay(win)
 
-    # Schedule initial simulation speed
+    # Initial simulation speed. Ticks are run every frame, as many as the elapsed time requires
     ticks_per_sec = 25.0
-    pyglet.clock.schedule_interval(controller.tick, 1 / ticks_per_sec)
+    controller.set_tick_speed(ticks_per_sec)
+    pyglet.clock.schedule(controller.update)
 
     # Cap FPS
     max_fps = 120
-    if "max_FPS" in app.CONFIG:
-        max_fps = app.CONFIG["max_FPS"]
+    if "max_FPS" in CONFIG:
+        max_fps = CONFIG["max_FPS"]
     pyglet.clock.set_fps_limit(max_fps)
 
+    # Lower the quality when the app can't keep up
+    if "adaptive_quality" in CONFIG and CONFIG["adaptive_quality"]:
+        from Particles.controllers import governor
+        max_tps = 400
+        if "max_TPS" in CONFIG:
+            max_tps = CONFIG["max_TPS"]
+        quality_governor = governor.default_governor(sim, controller, max_fps, max_tps)
+        pyglet.clock.schedule(quality_governor.update)
+
     # Draw event
-    @app.win.event
+    @win.event
     def on_draw():
         starttime = time.time()
-        app.win.clear()
+        win.clear()
+        Transform.set_world_view()
         sim.draw()
         controller.draw()
         Profiler.add_profiler_data("draw_times", time.time() - starttime)
+        Transform.set_screen_view()
         if fps_counter: fps_counter.draw()
     
-    # Generate history (run the simulation without opening the window)
+    # Generate history (run the simulation before drawing anything)
     # This is useful to save time on drawing
-    history_length = 0
-    if history_length > 0:
-        paused_state = sim.paused
-        Logger.log_system("Generating {} ticks of history.".format(history_length))
-        starttime = time.time()
-        sim.paused = False
-        for _ in range(history_length):
-            controller.tick()
-        sim.paused = paused_state
-        Logger.log_system("Finished generating history. ({} s)".format((time.time() - starttime)))
+    if "history_length" in CONFIG and CONFIG["history_length"] > 0:
+        from Particles import headless
+        headless.generate_history(sim, CONFIG["history_length"])
 
     # Main app loop
     pyglet.app.run()
@@ -86,6 +109,9 @@ def post_run_stats(controller, sim):
     if avg_tick is not None:
         Logger.log(">> Avg. tick time: {} ms".format(avg_tick * 1000))
 
+    tick_stats = controller.scheduler.stats()
+    Logger.log(">> Scheduled ticks: {} run, {} dropped, {} late".format(tick_stats["ticks"], tick_stats["dropped"], tick_stats["late"]))
+
     Logger.log("<----------------->")
 
 
@@ -1,32 +1,30 @@
-import pyglet, os, json
 from Particles.utils import Transform
-from Particles.models import simulation
+from Particles.config import CONFIG
 
 
-# Create pyglet window
+# Pyglet window, created when an interactive session starts (see create_window)
 WIN_SIZE = (680, 680)
-win = pyglet.window.Window(width = WIN_SIZE[0], height = WIN_SIZE[1], resizable=True)
-win.set_caption("Particles")
-win.set_vsync(False)
+win = None
 
-# Setup transform
-Transform.set_win_size(win.width, win.height)
 
-@win.event
-def on_resize(w, h):
-    s = min(w, h)
-    Transform.set_win_size(s, s)
+def create_window():
+    """ Creates the app window (once) & returns it. """
 
-# Initialise config
-def setup_config(fname):
+    global win
+    if win is not None:
+        return win
 
-    CONFIG = dict()
-    if os.path.exists(fname):
-        with open(fname, 'r') as cfile:
-            CONFIG = json.load(cfile)
-    else:
-        print("Config file not found: '{}'".format(fname))
-    return CONFIG
+    import pyglet
+    win = pyglet.window.Window(width = WIN_SIZE[0], height = WIN_SIZE[1], resizable=True)
+    win.set_caption("Particles")
+    win.set_vsync(False)
 
-CONFIG = setup_config("./config.json")
+    # Setup transform
+    Transform.set_win_size(win.width, win.height)
 
+    @win.event
+    def on_resize(w, h):
+        s = min(w, h)
+        Transform.set_win_size(s, s)
+
+    return win
@@ -0,0 +1,56 @@
+"""
+    Configuration of the app, read from config.json.
+    Kept apart from the app (window) so headless runs can use it too.
+    The file is only read when a setting is first needed, and cached after that.
+"""
+import os, json
+
+
+DEFAULT_FILE = "./config.json"
+
+
+def setup_config(fname):
+
+    CONFIG = dict()
+    if os.path.exists(fname):
+        with open(fname, 'r') as cfile:
+            CONFIG = json.load(cfile)
+    else:
+        print("Config file not found: '{}'".format(fname))
+    return CONFIG
+
+
+class Config:
+    """ Settings of a config file. Behaves like a (read-mostly) dict. """
+
+    def __init__(self, fname=DEFAULT_FILE):
+        self.fname = fname
+        self._settings = None
+
+    def load(self, fname=None):
+        """ (Re)reads the settings, from fname if given. """
+        if fname is not None:
+            self.fname = fname
+        self._settings = setup_config(self.fname)
+        return self
+
+    @property
+    def settings(self):
+        if self._settings is None:
+            self.load()
+        return self._settings
+
+    def get(self, key, default=None):
+        return self.settings.get(key, default)
+
+    def __contains__(self, key):
+        return key in self.settings
+
+    def __getitem__(self, key):
+        return self.settings[key]
+
+    def __setitem__(self, key, value):
+        self.settings[key] = value
+
+
+CONFIG = Config()
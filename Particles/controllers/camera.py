@@ -0,0 +1,67 @@
+"""
+    Camera of the interactive view: zooming, panning & following an entity.
+    The view itself lives in Transform (CAM_CENTER & CAM_ZOOM), so everything mapping
+    between world & window (drawing, picking) follows the camera.
+"""
+from Particles.utils import Transform, Logger
+
+
+MIN_ZOOM = 0.5
+MAX_ZOOM = 100.0
+ZOOM_STEP = 1.15 # Zoom factor per step of the mouse wheel
+
+
+class Camera:
+
+    def __init__(self, sim):
+        self.sim = sim
+        self._followed = None # Handle of the followed entity
+
+    @property
+    def center(self):
+        return Transform.CAM_CENTER
+
+    @property
+    def zoom(self):
+        return Transform.CAM_ZOOM
+
+    def zoom_at(self, steps, anchor=None):
+        """ Zooms in (or out, if steps < 0), keeping the world position anchor in the same place on screen. """
+
+        old = Transform.CAM_ZOOM
+        new = min(max(old * (ZOOM_STEP ** steps), MIN_ZOOM), MAX_ZOOM)
+        if anchor is None or self._followed is not None:
+            Transform.set_camera(zoom=new)
+            return
+        c = Transform.CAM_CENTER
+        ratio = old / new
+        Transform.set_camera(center=(anchor[0] + (c[0] - anchor[0]) * ratio, anchor[1] + (c[1] - anchor[1]) * ratio), zoom=new)
+
+    def pan(self, d_x, d_y):
+        """ Moves the view by (d_x, d_y) world units. Stops following. """
+        self._followed = None
+        c = Transform.CAM_CENTER
+        Transform.set_camera(center=(c[0] + d_x, c[1] + d_y))
+
+    def follow(self, e):
+        """ Keeps e in the centre of the view (until it leaves the simulation). None stops following. """
+        self._followed = None if e is None else e.handle
+        Logger.log_custom("control", "Camera following {}.".format(e))
+
+    @property
+    def following(self):
+        return self._followed is not None
+
+    def reset(self):
+        self._followed = None
+        Transform.set_camera(center=(0.0, 0.0), zoom=1.0)
+
+    def update(self):
+        """ Called every frame, before drawing. """
+        if self._followed is None:
+            return
+        e = self.sim.get_entity(self._followed)
+        if e is None:
+            self._followed = None
+            return
+        Transform.set_camera(center=e.pos)
@@ -1,5 +1,10 @@
+"""
+    Controller UI elements.
+    UI elements are retained: their graphics are added to the UI's batch once (see attach)
+    & only rebuilt when what they show changes (see refresh).
+"""
 import pyglet
-from Particles.utils import Shapes, Transform
+from Particles.utils import Renderer, Shapes, Transform
 from Particles.controllers import controls
 
 
@@ -7,15 +12,38 @@ class CUI_object:
 
     def __init__(self, anchor):
 
-        self.anchor = anchor
+        self._anchor = anchor
         self.parent = None
         self.children = list()
         self.shape = None
-    
-    def draw(self):
 
+        # Graphics
+        self.batch = None
+        self.depth = 0     # Elements are drawn above the ones with a lower depth
+        self.dirty = True  # Graphics need to be rebuilt
+
+    @property
+    def anchor(self):
+        return self._anchor
+
+    @anchor.setter
+    def anchor(self, anchor):
+        self._anchor = anchor
+        self.dirty = True
+
+    def attach(self, batch, depth=0):
+        """ Adds the graphics of the element (& its children) to batch. """
+
+        self.batch = batch
+        self.depth = depth
         for child in self.children:
-            child.draw()
+            child.attach(batch, depth + 1)
+
+    def refresh(self):
+        """ Rebuilds the graphics that changed since they were last drawn. """
+
+        for child in self.children:
+            child.refresh()
 
     def rescale(self, s):
 
@@ -42,14 +70,26 @@ class CUI_canvas(CUI_object):
         self.w = w
         self.h = h
         self.color = color
-        self.shape = Shapes.make_rect(self.anchor, self.w, self.h, color=self.color, as_vertexlist = True)
 
-    def draw(self):
+    def attach(self, batch, depth=0):
+
+        if self.shape is not None:
+            self.shape.delete()
         verts, colors = Shapes.make_rect(self.anchor, self.w, self.h, color=self.color)
-        self.shape.vertices = verts[1]
-        self.shape.draw(pyglet.gl.GL_POLYGON)
+        self.shape = batch.add(4, pyglet.gl.GL_QUADS, pyglet.graphics.OrderedGroup(depth),
+                               ('v2f/dynamic', verts[1]), ('c3B/static', colors[1]))
+        self.dirty = False
+
+        super().attach(batch, depth)
+
+    def refresh(self):
 
-        super().draw()
+        if self.dirty and self.shape is not None:
+            verts, colors = Shapes.make_rect(self.anchor, self.w, self.h, color=self.color)
+            self.shape.vertices = verts[1]
+            self.dirty = False
+
+        super().refresh()
 
     def child_clicked(self, pos):
 
@@ -81,15 +121,39 @@ class CUI_label(CUI_object):
 
         self.text = text
         self.size = size
-        self.label = Shapes.make_label(self.text, self.anchor, self.size, anchor_x='left', anchor_y='top')
+        self.label = None
+        self._win_size = None # Window size the label was placed for
 
-    def draw(self):
-        # Resize if parent exists
-        if self.parent is not None:
-            self.label.size = (self.parent.w / self.parent.h)
-        self.label.draw()
+    def attach(self, batch, depth=0):
+
+        if self.label is not None:
+            self.label.delete()
+        group = Renderer.ScreenGroup(pyglet.graphics.OrderedGroup(depth))
+        self.label = Shapes.make_label(self.text, self.anchor, self.size, anchor_x='left', anchor_y='top',
+                                       batch=batch, group=group, camera=False)
+        self._win_size = (Transform.WIN_WIDTH, Transform.WIN_HEIGHT)
+        self.dirty = False
 
-        super().draw()
+        super().attach(batch, depth)
+
+    def set_text(self, text):
+        if text != self.text:
+            self.text = text
+            if self.label is not None:
+                self.label.text = text
+
+    def refresh(self):
+
+        # Labels are placed in pixels, so they move along when the window is resized
+        win_size = (Transform.WIN_WIDTH, Transform.WIN_HEIGHT)
+        if self.label is not None and (self.dirty or win_size != self._win_size):
+            self.label.begin_update()
+            self.label.x, self.label.y = Transform.world_to_screen(self.anchor, camera=False)
+            self.label.end_update()
+            self._win_size = win_size
+            self.dirty = False
+
+        super().refresh()
 
     def is_clicked(self, pos):
         return False # Labels aren't clickable
@@ -160,10 +224,11 @@ class ControllerUI:
         self.visible = False
         self.anchor = (0.6, 1) #(1.05, 1)
         self.elements = list()
+        self.batch = pyglet.graphics.Batch() # All elements are drawn from here
 
         # Setup background
         self.bg = CUI_canvas(self.anchor, w=0.4, h=2)
-        self.elements.append(self.bg)
+        self.add_element(self.bg)
 
         setup_UI(self)
 
@@ -173,8 +238,10 @@ class ControllerUI:
         """ Adds an element to to UI. """
         if parent is not None:
             parent.children.append(e)
+            e.attach(self.batch, parent.depth + 1)
         else:
             self.elements.append(e)
+            e.attach(self.batch)
 
     def add_button(self, anchor, w, h, color=(220, 220, 220), parent=None, on_click=None):
         """ Adds a button. """
@@ -221,7 +288,9 @@ class ControllerUI:
         if not self.visible:
             return
 
-        self.bg.draw()
+        for e in self.elements:
+            e.refresh()
+        self.batch.draw()
     
 
 def setup_UI(c):
@@ -1,28 +1,12 @@
-from Particles.utils import Logger, Transform
+from Particles.utils import Logger
 from Particles.models import particle_factory
-from Particles.app import CONFIG
+from Particles.config import CONFIG
 from pyglet.window import key, mouse
 import pyglet, math
 
 
 # Control methods
 # Particle model methods
-def find_closest_entity(pos, entities, r):
-
-    closest = (None, None)
-    for e in entities:
-        try:
-            d = Transform.dist(pos, e.pos) - e.size
-            if d <= r:
-                if closest[1] is None:
-                    closest = (e, d)
-                elif closest[1] > d:
-                    closest = (e, d)
-        except AttributeError:
-            # Not a selectable entity
-            continue
-    return closest[0]
-
 def change_particle_velocity(symbol, particle):
     # Changes a particle's velocity based on the key pressed
 
@@ -78,11 +62,10 @@ def toggle_particle_movable(particle):
 def set_global_particle_radius(sim, r):
     """ Sets all PrimordialParticle's radii. Note: This is rather costly """
 
+    # Only particles with a radius (force particles have no slot for it)
     for e in sim.entities:
-        try:
+        if hasattr(e, "radius"):
             e.radius = r
-        except AttributeError:
-            Logger.log_warning("Can't set radius of entity: {}".format(e))
     Logger.log_custom("control", "Set global particle radius to {}.".format(r))
 
 def set_global_particle_velocity(sim, v):
@@ -121,9 +104,7 @@ def set_tick_speed(controller, symbol):
     else:
         new_tps = max(1, old_tps / 2.0)
 
-    pyglet.clock.unschedule(controller.tick)
-    pyglet.clock.schedule_interval(controller.tick, 1.0/new_tps)
-    controller.ticks_per_secs = new_tps
+    controller.set_tick_speed(new_tps)
     Logger.log_system("Set TPS to {}.".format(controller.ticks_per_secs))
 
 def spawn_particle(sim, data):
@@ -0,0 +1,126 @@
+"""
+    Adaptive quality of the interactive app.
+    The governor watches the rolling draw & tick times (see Profiler) against the budget that
+    max_FPS & max_TPS leave for them. When the app can't keep up, it lowers one quality knob
+    at a time, in order: circle tessellation, trail density, debug views (force lines & labels),
+    draw frequency and finally ticks per frame. When there's room again, it restores them
+    in reverse order. Every change is logged.
+"""
+import time
+from Particles.utils import Logger, Profiler
+
+
+WINDOW = 30          # Samples (frames / ticks) the load is averaged over
+DEGRADE_LOAD = 1.0   # Share of the time busy drawing & ticking above which quality is lowered
+RESTORE_LOAD = 0.5   # ... & below which it's restored
+DEGRADE_DELAY = 1.0  # Min. seconds between lowering knobs
+RESTORE_DELAY = 3.0  # Min. seconds between restoring knobs (& after lowering one)
+
+
+class Knob:
+    """ A quality setting: its normal value & the values it's lowered to, in order. """
+
+    def __init__(self, name, normal, lowered, apply):
+        self.name = name
+        self.normal = normal
+        self.lowered = lowered
+        self.apply = apply
+        self.value = normal
+
+
+class QualityGovernor:
+
+    def __init__(self, knobs, max_fps, max_tps, tps_func):
+
+        # Every step lowers one knob to its next value
+        self.knobs = knobs
+        self.steps = [(knob, value) for knob in knobs for value in knob.lowered]
+        self.level = 0 # Steps taken
+
+        self.max_fps = max_fps
+        self.max_tps = max_tps
+        self.tps_func = tps_func # Current target ticks per second
+        self.fps = max_fps       # Current FPS limit (a knob)
+        self.max_ticks = None    # Current max. ticks per frame (a knob)
+
+        self._last_change = time.perf_counter()
+
+    def load(self):
+        """ Returns the share of every second spent drawing & ticking at the targeted rates, from the latest timings.
+            None if there aren't enough timings yet.
+        """
+
+        draw_times = Profiler.PROFILER_DATA.get("draw_times", [])[-WINDOW:]
+        tick_times = Profiler.PROFILER_DATA.get("tick_times", [])[-WINDOW:]
+        if len(draw_times) < WINDOW:
+            return None
+
+        tps = min(self.tps_func(), self.max_tps)
+        if self.max_ticks is not None:
+            tps = min(tps, self.max_ticks * self.fps)
+        load = (sum(draw_times) / len(draw_times)) * self.fps
+        if len(tick_times) > 0:
+            load += (sum(tick_times) / len(tick_times)) * tps
+        return load
+
+    def update(self, dt=None):
+        """ Called every frame: lowers or restores a knob if the load asks for it. """
+
+        now = time.perf_counter()
+        since_change = now - self._last_change
+        if since_change < DEGRADE_DELAY:
+            return
+
+        load = self.load()
+        if load is None:
+            return
+        if load > DEGRADE_LOAD and self.level < len(self.steps):
+            knob, value = self.steps[self.level]
+            self.level += 1
+            self._set(knob, value, "Lowered", load)
+        elif load < RESTORE_LOAD and self.level > 0 and since_change >= RESTORE_DELAY:
+            self.level -= 1
+            knob = self.steps[self.level][0]
+            # Back to the knob's previous step, or normal if this was its first
+            value = knob.normal
+            for k, v in self.steps[:self.level]:
+                if k is knob:
+                    value = v
+            self._set(knob, value, "Restored", load)
+
+    def _set(self, knob, value, action, load):
+        Logger.log_system("{} quality: {} {} -> {} (load {:.2f}).".format(action, knob.name, knob.value, value, load))
+        knob.value = value
+        knob.apply(value)
+        self._last_change = time.perf_counter()
+
+
+def default_governor(sim, controller, max_fps, max_tps):
+    """ Returns the governor of the app's simulation & controller, with the knobs in order. """
+
+    import pyglet
+    from Particles.utils import Renderer
+
+    governor = None
+
+    def set_lod_error(v):
+        if sim.renderer is not None:
+            sim.renderer.max_error = v
+
+    def set_fps(v):
+        governor.fps = v
+        pyglet.clock.set_fps_limit(v)
+
+    def set_max_ticks(v):
+        governor.max_ticks = v
+        controller.scheduler.max_ticks = v
+
+    knobs = [
+                Knob("circle tessellation error (px)", Renderer.LOD_MAX_ERROR, [2.0, 8.0], set_lod_error),
+                Knob("trail point stride", 1, [2, 4], lambda v: setattr(sim, "trail_stride", v)),
+                Knob("debug views", True, [False], lambda v: setattr(sim, "draw_debug_views", v)),
+                Knob("max FPS", max_fps, [max_fps / 2.0, max_fps / 4.0], set_fps),
+                Knob("max ticks per frame", None, [4, 1], set_max_ticks)
+            ]
+    governor = QualityGovernor(knobs, max_fps, max_tps, lambda: 0 if sim.paused else controller.ticks_per_secs)
+    return governor
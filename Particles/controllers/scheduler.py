@@ -0,0 +1,79 @@
+"""
+    Fixed timestep scheduling of simulation ticks.
+    Called once per frame with the elapsed time, the scheduler runs as many ticks as that
+    time is worth at the target rate, carrying the remainder over to the next frame.
+    Catching up is bounded by a time budget per frame: ticks that don't fit are dropped
+    (& reported) instead of piling up, so a slow simulation can't stall the app.
+"""
+import time
+from Particles.utils import Logger
+
+
+FRAME_BUDGET = 0.05  # Max. seconds spent ticking per frame
+REPORT_INTERVAL = 1.0 # Min. seconds between dropped tick warnings
+
+
+class FixedTimestep:
+
+    def __init__(self, tick_func, ticks_per_sec=50.0, frame_budget=FRAME_BUDGET):
+
+        self.tick_func = tick_func
+        self.ticks_per_sec = ticks_per_sec
+        self.frame_budget = frame_budget
+        self.max_ticks = None # Max. ticks per frame (None: only the frame budget limits them)
+
+        # Simulated time owed (s)
+        self.accumulator = 0.0
+
+        # Stats
+        self.ticks = 0
+        self.dropped = 0   # Ticks skipped because they didn't fit in the frame budget
+        self.late = 0      # Ticks run more than a frame budget behind schedule
+        self._unreported = 0
+        self._last_report = 0.0
+
+    def set_rate(self, ticks_per_sec):
+        """ Changes the target rate. Time already owed is kept (in seconds, not ticks). """
+        self.ticks_per_sec = ticks_per_sec
+
+    def update(self, dt):
+        """ Runs the ticks dt seconds are worth (plus whatever was owed). Returns the amount of ticks run. """
+
+        step = 1.0 / self.ticks_per_sec
+        self.accumulator += dt
+
+        ran = 0
+        starttime = time.perf_counter()
+        while self.accumulator >= step:
+            if ran > 0 and (time.perf_counter() - starttime) >= self.frame_budget:
+                break
+            if self.max_ticks is not None and ran >= self.max_ticks:
+                break
+            if self.accumulator > max(self.frame_budget, step) + step:
+                self.late += 1
+            self.tick_func()
+            self.accumulator -= step
+            ran += 1
+
+        # Whatever is still owed beyond one step won't be caught up with
+        if self.accumulator >= step:
+            dropped = int(self.accumulator / step)
+            self.accumulator -= dropped * step
+            self.dropped += dropped
+            self._unreported += dropped
+
+        self.ticks += ran
+        self.report()
+        return ran
+
+    def report(self):
+        """ Warns about dropped ticks, at most once every REPORT_INTERVAL. """
+
+        now = time.perf_counter()
+        if self._unreported > 0 and (now - self._last_report) >= REPORT_INTERVAL:
+            Logger.log_warning("Dropped {} ticks: can't keep up with {} TPS.".format(self._unreported, self.ticks_per_sec))
+            self._unreported = 0
+            self._last_report = now
+
+    def stats(self):
+        return {"ticks": self.ticks, "dropped": self.dropped, "late": self.late}
@@ -2,7 +2,7 @@ import pyglet, time
 from pyglet.window import key, mouse
 from enum import Enum
 from Particles.models import simulation
-from Particles.controllers import controller_ui, controls
+from Particles.controllers import camera, controller_ui, controls, scheduler
 from Particles.utils import Transform, Shapes, Logger, Profiler
 from Particles import persistence
 
@@ -26,16 +26,28 @@ class SimController:
         # Controller parameters
         self.mode = ModeEnum.SELECT
         self.ticks_per_secs = 50.0
+        self.scheduler = scheduler.FixedTimestep(self.tick, self.ticks_per_secs)
         self.creatable_types = get_creatable_types()
         self.cur_creation_index = 0
 
-        self._cur_selected = None
+        self._selected = None # Handle of the selected entity
         self._ui = controller_ui.ControllerUI()
+        self.camera = camera.Camera(sim)
 
         # Graphics
         self._selection_ring = Shapes.make_circle(as_vertexlist=True)
 
 
+    @property
+    def _cur_selected(self):
+        """ Selected entity, None if nothing is selected or it left the simulation. """
+        return self.sim.get_entity(self._selected)
+
+    @_cur_selected.setter
+    def _cur_selected(self, e):
+        self._selected = None if e is None else e.handle
+
+
     # Handle events
     def on_mouse_press(self, x, y, btn, modifiers):
         # Handle mouse click
@@ -43,15 +55,15 @@ class SimController:
         if self.mode == ModeEnum.SELECT:
 
             if btn == mouse.LEFT:
+                # First check if the click should be handled by the UI (which doesn't move with the camera)
+                if self._ui.on_click(self, Transform.screen_to_world((x, y), camera=False), btn):
+                    return
+
                 # Select entity under mouse
                 pos = Transform.screen_to_world((x, y))
 
-                # First check if the click should be handled by the UI
-                if self._ui.on_click(self, pos, btn):
-                    return
-
                 r = 0.1
-                self._cur_selected = controls.find_closest_entity(pos, self.sim.entities, r)                    
+                self._cur_selected = self.sim.closest_entity(pos, r)
             elif btn == mouse.RIGHT:
                 # Deselect current entity
                 self._cur_selected = None
@@ -99,6 +111,13 @@ class SimController:
                 if self._cur_selected is not None:
                     controls.toggle_particle_movable(self._cur_selected)
 
+            if symbol == key.F:
+                # Follow the selected entity (or stop following)
+                self.camera.follow(self._cur_selected)
+
+            if symbol == key.HOME:
+                self.camera.reset()
+
             if symbol == key.S and modifiers == 18: # CRTL+S
                 Logger.log_custom("control", "Saving current state...")
                 persistence.save_to_json(self.sim)
@@ -126,14 +145,33 @@ class SimController:
                 Logger.log_custom("control", "Changed creation type to {}.".format(self.creatable_types[self.cur_creation_index]))
     
     def on_mouse_drag(self, x, y, dx, dy, buttons, modifiers):
+        pos = Transform.screen_to_world((x, y), camera=False)
+        d_x = Transform.screen_dist_to_world_dist(dx, camera=False)
+        d_y = Transform.screen_dist_to_world_dist(dy, camera=False)
+        if self._ui.on_drag(self, pos, (d_x, d_y), buttons):
+            return
+
+        # Drag the world along with the mouse
+        prev = Transform.screen_to_world((x - dx, y - dy))
         pos = Transform.screen_to_world((x, y))
-        d_x = Transform.screen_dist_to_world_dist(dx)
-        d_y = Transform.screen_dist_to_world_dist(dy)
-        self._ui.on_drag(self, pos, (d_x, d_y), buttons)
+        self.camera.pan(prev[0] - pos[0], prev[1] - pos[1])
+
+    def on_mouse_scroll(self, x, y, scroll_x, scroll_y):
+        # Zoom towards the mouse
+        self.camera.zoom_at(scroll_y, Transform.screen_to_world((x, y)))
 
         
     # Simulation control
 
+    def update(self, dt):
+        """ Called every frame with the elapsed time. Runs the ticks that time is worth. """
+        self.scheduler.update(dt)
+        self.camera.update()
+
+    def set_tick_speed(self, ticks_per_sec):
+        self.ticks_per_secs = ticks_per_sec
+        self.scheduler.set_rate(ticks_per_sec)
+
     def tick(self, dt=1):
 
         starttime = time.time()
@@ -167,7 +205,8 @@ class SimController:
             pyglet.gl.glLineWidth(1)
             self._selection_ring.draw(pyglet.gl.GL_LINE_LOOP)
 
-        # Draw UI
+        # Draw UI (in a fixed view)
+        Transform.set_world_view(camera=False)
         self._ui.draw()
 
 
@@ -0,0 +1,212 @@
+"""
+    Headless batch runs.
+    Builds a simulation and advances it as fast as possible, without ever opening a window
+    (or importing pyglet), writing snapshots & timing stats along the way.
+
+    Usage:
+        python -m Particles.headless --ticks 1000 --scenario force --out ./runs/force
+        python -m Particles.headless --startup-report
+        python -m Particles.headless --accuracy-report 2000 --theta 0.5
+    The scenario is one of SCENARIOS, or the path of a saved state (.json).
+"""
+import argparse, json, os, random, time
+from Particles import persistence
+from Particles.models import simulation
+from Particles.utils import Logger, Profiler
+
+
+SCENARIOS = {
+                "default": lambda n=None: simulation.setup(),
+                "force": simulation.setup_force,
+                "primordial": simulation.setup_primordial,
+                "automata": simulation.setup_automata
+            }
+
+
+def build_simulation(scenario, n=None):
+    """ Returns the simulation for a scenario name or saved state. n is the amount of particles (if supported). """
+
+    if scenario in SCENARIOS:
+        if n is None:
+            return SCENARIOS[scenario]()
+        return SCENARIOS[scenario](n)
+
+    if os.path.exists(scenario):
+        sim = simulation.Simulation()
+        persistence.load_from_json(sim, path=scenario)
+        return sim
+
+    raise ValueError("Unknown scenario '{}'. Use one of {} or a saved state.".format(scenario, list(SCENARIOS.keys())))
+
+
+def run_ticks(sim, ticks, out=None, snapshot_every=0):
+    """ Advances the simulation ticks times, ignoring its paused state. Returns the duration of every tick.
+        If out is given, a snapshot is saved there every snapshot_every ticks (& after the last one).
+    """
+
+    tick_times = list()
+    paused_state = sim.paused
+    sim.paused = False
+
+    for t in range(1, ticks + 1):
+        starttime = time.perf_counter()
+        sim.tick()
+        tick_times.append(time.perf_counter() - starttime)
+
+        if out is not None and ((snapshot_every > 0 and t % snapshot_every == 0) or t == ticks):
+            save_snapshot(sim, out)
+
+    sim.paused = paused_state
+    return tick_times
+
+
+def generate_history(sim, ticks):
+    """ Runs the simulation before the app starts drawing it. """
+
+    Logger.log_system("Generating {} ticks of history.".format(ticks))
+    starttime = time.time()
+    tick_times = run_ticks(sim, ticks)
+    if "tick_times" in Profiler.PROFILER_DATA:
+        Profiler.PROFILER_DATA["tick_times"] += tick_times
+    Logger.log_system("Finished generating history. ({} s)".format((time.time() - starttime)))
+
+
+def save_snapshot(sim, out):
+    fname = os.path.join(out, "tick_{:08d}.json".format(sim.lifetime))
+    persistence.save_to_json(sim, path=fname)
+
+
+def get_stats(sim, tick_times):
+    """ Summarizes the tick durations of a run. """
+
+    total = sum(tick_times)
+    ordered = sorted(tick_times)
+    stats = {
+                "ticks": len(tick_times),
+                "entities": len(sim.entities),
+                "lifetime": sim.lifetime,
+                "total_time": total,
+                "ticks_per_sec": (len(tick_times) / total) if total > 0 else None,
+                "avg_tick_ms": (total / len(tick_times)) * 1000 if len(tick_times) > 0 else None,
+                "min_tick_ms": ordered[0] * 1000 if len(ordered) > 0 else None,
+                "median_tick_ms": ordered[len(ordered) // 2] * 1000 if len(ordered) > 0 else None,
+                "max_tick_ms": ordered[-1] * 1000 if len(ordered) > 0 else None
+            }
+    neighbour_lists = sim.neighbour_list_stats()
+    if len(neighbour_lists) > 0:
+        stats["neighbour_lists"] = neighbour_lists
+    return stats
+
+
+# Memory per entity (bytes, 100k of each) before particles had __slots__ & shared per-type parameters
+BASELINE_BYTES = {
+                    "ForceParticle (PType1)": 712,
+                    "PrimordialParticle": 360,
+                    "AutomatonParticle": 1392
+                 }
+
+
+def memory_report(n=100000):
+    """ Logs & returns the memory per entity (in bytes) of the main particle types, when creating n of each.
+        The reduction is logged against BASELINE_BYTES.
+    """
+
+    from Particles.models import particle, types
+    factories = {
+                    "ForceParticle (PType1)": lambda: types.PType1(0, 0),
+                    "PrimordialParticle": lambda: particle.PrimordialParticle(0, 0),
+                    "AutomatonParticle": lambda: particle.AutomatonParticle(0, 0)
+                }
+
+    report = dict()
+    Logger.log("<----------------->")
+    Logger.log("> Memory per entity ({} entities)".format(n))
+    for name, factory in factories.items():
+        report[name] = Profiler.measure_memory(factory, n)
+        Logger.log(">> {}: {:.0f} bytes ({:.1f} MB in total), {} bytes before ({:.1f}x less)".format(
+                   name, report[name], report[name] * n / 1e6, BASELINE_BYTES[name], BASELINE_BYTES[name] / max(report[name], 1)))
+    Logger.log("<----------------->")
+    return report
+
+
+def accuracy_report(n=2000, theta=None):
+    """ Logs & returns how far the Barnes-Hut forces are off from the exact ones, for the force scenario with n particles. """
+
+    from Particles.models import barnes_hut, particle
+    sim = simulation.setup_force(n)
+    particles = [e for e in sim.entities if isinstance(e, particle.ForceParticle)]
+    return barnes_hut.accuracy_report(particles, 0.5 if theta is None else theta)
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(prog="python -m Particles.headless", description="Run a simulation without a window.")
+    parser.add_argument("--ticks", type=int, default=None, help="Amount of ticks to run.")
+    parser.add_argument("--scenario", default="default",
+                        help="One of {}, or the path of a saved state.".format(", ".join(SCENARIOS.keys())))
+    parser.add_argument("--particles", type=int, default=None, help="Amount of particles in the scenario.")
+    parser.add_argument("--out", default=None, help="Folder for snapshots, stats & logs.")
+    parser.add_argument("--snapshot-every", type=int, default=0, help="Ticks between snapshots (0: only the last tick).")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for the scenario's random setup.")
+    parser.add_argument("--vectorized", action="store_true", help="Tick force particles with the vectorized engine.")
+    parser.add_argument("--theta", type=float, default=None,
+                        help="Barnes-Hut opening angle (with --vectorized or --accuracy-report, which defaults to 0.5).")
+    parser.add_argument("--workers", type=int, default=0, help="Worker processes computing forces (with --vectorized).")
+    parser.add_argument("--skin", type=float, default=None,
+                        help="Keep Verlet neighbour lists with this skin for primordial particles & automata.")
+    parser.add_argument("--startup-report", action="store_true",
+                        help="Log the import time of the headless runner (against Profiler.IMPORT_BUDGET) first.")
+    parser.add_argument("--memory-report", type=int, default=None, metavar="N",
+                        help="Log the memory per entity when creating N particles of each type first.")
+    parser.add_argument("--accuracy-report", type=int, default=None, metavar="N",
+                        help="Log the error of Barnes-Hut forces (with --theta) against the exact ones for N force particles first.")
+    args = parser.parse_args(argv)
+    if args.ticks is None and not args.startup_report and args.memory_report is None and args.accuracy_report is None:
+        parser.error("--ticks is required")
+
+    if args.out is not None:
+        os.makedirs(args.out, exist_ok=True)
+        Logger.set_output_file(os.path.join(args.out, "logs"))
+    Logger.clear_logfile()
+
+    if args.startup_report:
+        Profiler.startup_report("Particles.headless")
+    if args.memory_report is not None:
+        for name, size in memory_report(args.memory_report).items():
+            Logger.log_system("{}: {:.0f} bytes per entity.".format(name, size))
+    if args.accuracy_report is not None:
+        accuracy_report(args.accuracy_report, args.theta)
+    if args.ticks is None:
+        return None
+
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    sim = build_simulation(args.scenario, args.particles)
+    if args.vectorized:
+        sim.enable_force_engine(theta=args.theta, workers=args.workers)
+    if args.skin is not None:
+        sim.enable_neighbour_lists(skin=args.skin)
+
+    Logger.log_system("Running '{}' ({} entities) for {} ticks.".format(args.scenario, len(sim.entities), args.ticks))
+    tick_times = run_ticks(sim, args.ticks, args.out, args.snapshot_every)
+    stats = get_stats(sim, tick_times)
+
+    Logger.log("<----------------->")
+    Logger.log("> Headless run stats")
+    for k, v in stats.items():
+        Logger.log(">> {}: {}".format(k, v))
+    Logger.log("<----------------->")
+    if sim.force_engine is not None:
+        sim.enable_force_engine(False) # Stops the workers
+    Logger.log_system("Finished {} ticks in {} s ({} ticks/s).".format(stats["ticks"], stats["total_time"], stats["ticks_per_sec"]))
+
+    if args.out is not None:
+        with open(os.path.join(args.out, "stats.json"), 'w') as statsfile:
+            json.dump(dict(stats, scenario=args.scenario, tick_times=tick_times), statsfile)
+
+    return stats
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+    Vectorized (NumPy) tick for AutomatonParticle populations.
+    Counts the neighbours of all automata at once (by minimum image distance, as the world
+    wraps around; from a grid or a Verlet neighbour list), picks their states & moves them, instead of calling AutomatonParticle.tick
+    & finish_tick per particle.
+    Each statespace (usually the one shared by default) is compiled into a table of the
+    velocities of its states, so the state index of a particle is all it takes to move it.
+    The objects stay the reference state: arrays are read from them every tick & the new
+    states & positions are written back.
+"""
+import numpy as np
+from Particles.models import particle
+from Particles.utils import DataStructures
+
+
+# Max. amount of pairs evaluated at once (bounds memory use)
+BLOCK_SIZE = 1 << 20
+
+
+def handles(e):
+    """ Returns True if e's simulation step is the plain AutomatonParticle step. """
+    t = type(e)
+    return isinstance(e, particle.AutomatonParticle) \
+           and t.tick is particle.AutomatonParticle.tick \
+           and t.finish_tick is particle.AutomatonParticle.finish_tick \
+           and t.state_func is particle.AutomatonParticle.state_func
+
+
+def velocity_table(S):
+    """ Returns the (states x 2) velocities of a statespace. """
+    return np.array([s.velocity for s in S], dtype=float).reshape(-1, 2)
+
+
+def wrapped_delta(d):
+    """ Shortest (signed) distance along an axis of the wrapped world, for the plain distances d. """
+    period = 2 * particle.WRAP_BORDER
+    return d - (period * np.round(d / period))
+
+
+def near_pairs(t_ix, s_ix, t_pos, t_radius, s_pos):
+    """ Returns which (target, source) pairs are within the target's radius in the wrapped world.
+        Target & source indices broadcast against each other (e.g. a column of targets & a row of sources).
+    """
+
+    vec_x = wrapped_delta(s_pos[s_ix, 0] - t_pos[t_ix, 0])
+    vec_y = wrapped_delta(s_pos[s_ix, 1] - t_pos[t_ix, 1])
+    dist_sq = vec_x * vec_x
+    dist_sq += vec_y * vec_y
+    return dist_sq < np.square(t_radius)[t_ix]
+
+
+def count_neighbours(t_pos, t_radius, t_self, s_pos, neighbours=None):
+    """ Returns the amount of sources within the radius of each target, in the wrapped world.
+        t_self is the index of each target among the sources (-1 if it isn't one), targets don't count themselves.
+        Candidates come from a grid, or the pairs of neighbours (a DataStructures.VerletList) if given.
+    """
+
+    n = len(t_pos)
+    n_total = np.zeros(n, dtype=np.intp)
+    if n == 0 or len(s_pos) == 0:
+        return n_total
+
+    if neighbours is not None:
+        t_ix, s_ix = neighbours.pairs(t_pos, t_radius, s_pos)
+        for start in range(0, len(t_ix), BLOCK_SIZE):
+            t_block = t_ix[start:start + BLOCK_SIZE]
+            near = near_pairs(t_block, s_ix[start:start + BLOCK_SIZE], t_pos, t_radius, s_pos)
+            n_total += np.bincount(t_block[near], minlength=n)
+    else:
+        period = 2 * particle.WRAP_BORDER
+        for group, sources in DataStructures.grid_blocks(t_pos, s_pos, np.abs(t_radius).max(), period):
+            block = max(1, BLOCK_SIZE // len(sources))
+            for start in range(0, len(group), block):
+                targets = group[start:start + block]
+                n_total[targets] = np.count_nonzero(near_pairs(targets[:, None], sources[None, :], t_pos, t_radius, s_pos), axis=1)
+
+    # A target is near itself, unless its radius is 0
+    n_total -= (t_self >= 0) & (t_radius != 0)
+    return n_total
+
+
+class AutomatonEngine:
+
+    def __init__(self, neighbours=None):
+
+        # Verlet neighbour list (DataStructures.VerletList) kept across ticks, None to find neighbours every tick
+        self.neighbours = neighbours
+
+        # Automata ticked during the current tick & the velocity of their (new) state
+        self.particles = list()
+        self.velocity = np.zeros((0, 2))
+
+    def handles(self, e):
+        return handles(e)
+
+
+    # Simulation
+
+    def tick(self, entities):
+        """ Counts the neighbours of every automaton the engine handles & sets its state.
+            Counterpart of AutomatonParticle.tick, for the whole population.
+        """
+
+        self.particles = [e for e in entities if handles(e)]
+        n = len(self.particles)
+        self.velocity = np.zeros((n, 2))
+        if n == 0:
+            return
+
+        # Every (unpaused & not deleted) entity is a neighbour
+        sources = list()
+        source_ix = dict()
+        for e in entities:
+            if not (e.paused or e.mfd):
+                source_ix[id(e)] = len(sources)
+                sources.append(e.pos)
+        s_pos = np.array(sources, dtype=float).reshape(-1, 2)
+
+        active = np.array([not (p.paused or p.mfd) for p in self.particles], dtype=bool)
+        targets = np.flatnonzero(active)
+        ticked = [self.particles[ix] for ix in targets]
+        t_pos = np.array([p.pos for p in ticked], dtype=float).reshape(-1, 2)
+        t_radius = np.array([p.radius for p in ticked], dtype=float)
+        t_self = np.array([source_ix.get(id(p), -1) for p in ticked], dtype=np.intp)
+        n_total = count_neighbours(t_pos, t_radius, t_self, s_pos, self.neighbours)
+
+        # States (see AutomatonParticle.state_func), per statespace
+        phase = np.array([p.state_phase for p in ticked], dtype=float)
+        statespaces = dict() # id(S) -> (S, rows of its particles among targets)
+        for row, p in enumerate(ticked):
+            statespaces.setdefault(id(p.S), (p.S, list()))[1].append(row)
+        for S, rows in statespaces.values():
+            rows = np.array(rows, dtype=np.intp)
+            state_ix = np.floor(n_total[rows] / phase[rows]).astype(np.intp) % len(S)
+            self.velocity[targets[rows]] = velocity_table(S)[state_ix]
+            for row, ix in zip(rows.tolist(), state_ix.tolist()):
+                ticked[row].state = S[ix]
+
+        for p, n_neighbours in zip(ticked, n_total.tolist()):
+            p._neighbourhood_size = n_neighbours
+
+        # The others keep their state
+        for ix in np.flatnonzero(~active):
+            self.velocity[ix] = self.particles[ix].state.velocity
+
+    def finish_tick(self):
+        """ Moves every automaton ticked by the engine (& still in the simulation), wrapping around at the border.
+            Counterpart of AutomatonParticle.finish_tick.
+        """
+
+        kept = np.array([p.handle is not None for p in self.particles], dtype=bool).reshape(-1)
+        if not kept.any():
+            return
+
+        border = particle.WRAP_BORDER
+        buffer = particle.WRAP_BUFFER
+        pos = np.array([p.pos for p in self.particles], dtype=float)[kept] + self.velocity[kept]
+        for axis in (0, 1):
+            pos[:, axis] = np.where(pos[:, axis] < -border, border - buffer,
+                                    np.where(pos[:, axis] > border, -border + buffer, pos[:, axis]))
+
+        for ix, p_pos in zip(np.flatnonzero(kept), pos.tolist()):
+            self.particles[ix].pos = tuple(p_pos)
@@ -0,0 +1,239 @@
+"""
+    Barnes-Hut approximation of the long range forces between force particles.
+    Particles are bucketed in a quadtree over the world. Nodes that are small compared
+    to their distance (size / distance < theta) act as one particle per type, placed in
+    the center of mass of that type. Close nodes are opened up to the leaves, where
+    particles interact exactly (close range repulsion included).
+"""
+import math, time
+import numpy as np
+from Particles.models import particle
+from Particles.utils import Logger
+
+
+WORLD = (-1.1, 1.1)
+LEAF_SIZE = 8   # Avg. amount of particles per leaf the depth aims for
+MAX_DEPTH = 9
+BLOCK_SIZE = 4096 # Targets traversing the tree at once (bounds memory use)
+
+
+class QuadTree:
+
+    def __init__(self, pos, size, mass, type_id, n_types, ids=None, depth=None):
+        """ Builds the tree over the given particles. mass is the mass the particles act with (mass * F_size_mod).
+            ids identify the particles, so targets can skip themselves.
+        """
+
+        n = len(pos)
+        if ids is None:
+            ids = np.arange(n)
+        if depth is None:
+            depth = int(math.ceil(math.log(max(n / LEAF_SIZE, 1), 4)))
+            depth = min(max(depth, 1), MAX_DEPTH)
+
+        self.depth = depth
+        self.n_types = n_types
+        self.low, self.high = WORLD
+
+        # Sort particles by leaf, so every leaf is a contiguous range
+        side = 1 << depth
+        width = (self.high - self.low) / side
+        grid = np.clip(np.floor((pos - self.low) / width), 0, side - 1).astype(np.intp)
+        leaf = (grid[:, 0] * side) + grid[:, 1]
+        order = np.argsort(leaf, kind='stable')
+
+        self.pos = pos[order]
+        self.size = size[order]
+        self.mass = mass[order]
+        self.type_id = type_id[order]
+        self.ids = ids[order]
+        grid = grid[order]
+        leaf = leaf[order]
+        self.leaf_start = np.searchsorted(leaf, np.arange(side * side), side='left')
+        self.leaf_end = np.searchsorted(leaf, np.arange(side * side), side='right')
+        self.max_size = self.size.max() if n > 0 else 0
+
+        # Per level & node: particle count, mass & center of mass (per type & in total)
+        self.count = list()
+        self.type_mass = list()
+        self.type_com = list()
+        self.com = list()
+        for l in range(depth + 1):
+            shift = depth - l
+            s = 1 << l
+            cells = s * s
+            node = ((grid[:, 0] >> shift) * s) + (grid[:, 1] >> shift)
+            key = (node * n_types) + self.type_id
+
+            m = np.bincount(key, weights=self.mass, minlength=cells * n_types).reshape(cells, n_types)
+            m_x = np.bincount(key, weights=self.mass * self.pos[:, 0], minlength=cells * n_types).reshape(cells, n_types)
+            m_y = np.bincount(key, weights=self.mass * self.pos[:, 1], minlength=cells * n_types).reshape(cells, n_types)
+
+            # Empty nodes get their center as center of mass
+            w = (self.high - self.low) / s
+            center = self.low + ((np.arange(s) + 0.5) * w)
+            center_x = np.repeat(center, s)
+            center_y = np.tile(center, s)
+
+            M = m.sum(axis=1)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                com = np.stack((np.where(M > 0, m_x.sum(axis=1) / M, center_x),
+                                np.where(M > 0, m_y.sum(axis=1) / M, center_y)), axis=1)
+                type_com = np.stack((np.where(m > 0, m_x / m, center_x[:, None]),
+                                     np.where(m > 0, m_y / m, center_y[:, None])), axis=2)
+
+            self.count.append(np.bincount(node, minlength=cells))
+            self.type_mass.append(m)
+            self.type_com.append(type_com)
+            self.com.append(com)
+
+    def calculate_forces(self, t_pos, t_size, t_type, t_F_min, t_ids, mods, theta):
+        """ Returns the force the particles in the tree apply to each target.
+            mods[s, t] is the type mod a particle of (tree) type s applies to one of type t.
+            Targets with an id in the tree don't act on themselves.
+        """
+
+        n = len(t_pos)
+        forces = np.zeros((n, 2))
+        if len(self.pos) == 0:
+            return forces
+
+        # Nodes are only approximated if they are out of repulsion range
+        r_rep = (t_size + self.max_size) * particle.REPEL_RANGE
+        targets = (t_pos, t_size, t_type, t_F_min, t_ids, r_rep * r_rep)
+        for start in range(0, n, BLOCK_SIZE):
+            block = slice(start, min(start + BLOCK_SIZE, n))
+            forces[block] = self._traverse([t[block] for t in targets], mods, theta)
+        return forces
+
+    def _traverse(self, targets, mods, theta):
+        """ Walks the tree level by level for a block of targets, keeping (target, node) pairs to visit. """
+
+        t_pos, t_size, t_type, t_F_min, t_ids, r_rep_sq = targets
+        n = len(t_pos)
+        forces = np.zeros((n, 2))
+        theta_sq = theta * theta
+
+        p_t = np.arange(n)
+        p_node = np.zeros(n, dtype=np.intp)
+        for l in range(self.depth + 1):
+            if len(p_t) == 0:
+                break
+            s = 1 << l
+            w = (self.high - self.low) / s
+            node_x = p_node // s
+            node_y = p_node % s
+            x = t_pos[p_t, 0]
+            y = t_pos[p_t, 1]
+
+            # Opening criterion (size / distance to center of mass < theta), and node out of repulsion range
+            com = self.com[l][p_node]
+            d_sq = ((com[:, 0] - x) ** 2) + ((com[:, 1] - y) ** 2)
+            b_x = np.maximum(np.abs(x - (self.low + ((node_x + 0.5) * w))) - (w / 2.0), 0)
+            b_y = np.maximum(np.abs(y - (self.low + ((node_y + 0.5) * w))) - (w / 2.0), 0)
+            far = ((w * w) < (theta_sq * d_sq)) & (((b_x * b_x) + (b_y * b_y)) > r_rep_sq[p_t])
+
+            if far.any():
+                forces += self._node_forces(l, p_t[far], p_node[far], n, t_pos, t_type, t_F_min, mods)
+
+            p_t = p_t[~far]
+            p_node = p_node[~far]
+            node_x = node_x[~far]
+            node_y = node_y[~far]
+            if l < self.depth:
+                # Open up nodes, skipping empty children
+                children = (((2 * node_x)[:, None] + [0, 0, 1, 1]) * (2 * s)) + ((2 * node_y)[:, None] + [0, 1, 0, 1])
+                p_t = np.repeat(p_t, 4)
+                p_node = children.ravel()
+                nonempty = self.count[l + 1][p_node] > 0
+                p_t = p_t[nonempty]
+                p_node = p_node[nonempty]
+            else:
+                forces += self._leaf_forces(p_t, p_node, n, t_pos, t_size, t_type, t_F_min, t_ids, mods)
+
+        return forces
+
+    def _node_forces(self, l, p_t, p_node, n, t_pos, t_type, t_F_min, mods):
+        """ Force of whole nodes, acting as one particle per type. """
+
+        m = self.type_mass[l][p_node]
+        com = self.type_com[l][p_node]
+        vec_x = com[:, :, 0] - t_pos[p_t, 0][:, None]
+        vec_y = com[:, :, 1] - t_pos[p_t, 1][:, None]
+        d_sq = (vec_x * vec_x) + (vec_y * vec_y)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            F = mods[:, t_type[p_t]].T * (m / d_sq)
+        F = np.where(m > 0, F, 0)
+        F[np.abs(F) < t_F_min[p_t, None]] = 0
+
+        return np.stack((np.bincount(p_t, weights=(F * vec_x).sum(axis=1), minlength=n),
+                         np.bincount(p_t, weights=(F * vec_y).sum(axis=1), minlength=n)), axis=1)
+
+    def _leaf_forces(self, p_t, p_node, n, t_pos, t_size, t_type, t_F_min, t_ids, mods):
+        """ Exact force of every particle in the leaves, as in ForceParticle.calculate_force. """
+
+        start = self.leaf_start[p_node]
+        counts = self.leaf_end[p_node] - start
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        src = np.repeat(start, counts) + offsets
+        p_t = np.repeat(p_t, counts)
+
+        vec_x = self.pos[src, 0] - t_pos[p_t, 0]
+        vec_y = self.pos[src, 1] - t_pos[p_t, 1]
+        d_sq = (vec_x * vec_x) + (vec_y * vec_y)
+
+        # Repelling force at very close range
+        min_dist = (self.size[src] + t_size[p_t]) * particle.REPEL_RANGE
+        min_dist *= min_dist
+        F_repelling = -(self.mass[src] * particle.F_REPEL) * (min_dist / (d_sq + 1e-6))
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            F = mods[self.type_id[src], t_type[p_t]] * (self.mass[src] / d_sq)
+        F[np.abs(F) < t_F_min[p_t]] = 0
+
+        F = np.where(d_sq <= min_dist, F_repelling, F)
+        F[self.ids[src] == t_ids[p_t]] = 0 # Particles don't act on themselves
+
+        return np.stack((np.bincount(p_t, weights=F * vec_x, minlength=n),
+                         np.bincount(p_t, weights=F * vec_y, minlength=n)), axis=1)
+
+
+def accuracy_report(particles, theta=0.5):
+    """ Logs & returns how far the Barnes-Hut forces on the particles are off from the exact (O(N^2)) ones. """
+
+    from Particles.models import force_engine
+
+    results = dict()
+    for name, engine in [("exact", force_engine.ForceEngine()), ("barnes_hut", force_engine.ForceEngine(theta=theta))]:
+        engine.load(list(particles))
+        targets = np.arange(len(engine.particles))
+        starttime = time.time()
+        results[name] = engine.calculate_forces(targets, engine.particles)
+        results[name + "_time"] = time.time() - starttime
+
+    exact = results["exact"]
+    error = np.sqrt(((results["barnes_hut"] - exact) ** 2).sum(axis=1))
+    magnitude = np.sqrt((exact ** 2).sum(axis=1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rel_error = np.where(magnitude > 0, error / magnitude, 0)
+
+    report = {
+                "particles": len(exact),
+                "theta": theta,
+                "exact_time": results["exact_time"],
+                "barnes_hut_time": results["barnes_hut_time"],
+                "median_rel_error": float(np.median(rel_error)) if len(exact) > 0 else 0.0,
+                "p99_rel_error": float(np.percentile(rel_error, 99)) if len(exact) > 0 else 0.0,
+                "max_rel_error": float(rel_error.max()) if len(exact) > 0 else 0.0,
+                "rms_error": float(np.sqrt((error ** 2).mean()) / max(np.sqrt((magnitude ** 2).mean()), 1e-300)) if len(exact) > 0 else 0.0
+             }
+
+    Logger.log("<----------------->")
+    Logger.log("> Barnes-Hut accuracy ({} particles, theta = {})".format(report["particles"], theta))
+    Logger.log(">> Exact: {} ms, Barnes-Hut: {} ms".format(report["exact_time"] * 1000, report["barnes_hut_time"] * 1000))
+    Logger.log(">> Relative error: median {}, 99th percentile {}, max {}".format(report["median_rel_error"], report["p99_rel_error"], report["max_rel_error"]))
+    Logger.log(">> RMS error (relative to RMS force): {}".format(report["rms_error"]))
+    Logger.log("<----------------->")
+
+    return report
@@ -2,11 +2,14 @@ from Particles.utils import Transform
 
 class Entity:
 
+    __slots__ = ("pos", "paused", "mfd", "handle", "debug_view")
+
     def __init__(self, x=0, y=0):
 
         self.pos = (x, y)
         self.paused = False
         self.mfd = False
+        self.handle = None # Set by the simulation's entity store
 
         # Graphics
         self.debug_view = False
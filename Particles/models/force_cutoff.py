@@ -0,0 +1,103 @@
+"""
+    Interaction cutoffs of force particles.
+    Outside the repulsion range, a source applies F = mod * mass * F_size_mod / dist^2 to a target,
+    & the force is dropped when |F| < F_min of the target. So it's exactly zero beyond
+        dist^2 = |mod| * mass * F_size_mod / F_min
+    which only depends on the pair's types (& the source's mass). Cutoffs are computed per
+    (source type, target type) from the largest mass of every type present. A target only visits
+    the sources within the cutoffs of its type (a box around it), in simulation order: the forces
+    it sums are exactly the ones it would have summed visiting every entity.
+    Cutoffs as large as the world don't exclude anything, & target types that would still visit
+    most of the sources visit all entities, as before.
+"""
+import numpy as np
+from Particles.models import particle, type_registry, force_engine
+
+
+CUTOFF_MARGIN = 1e-6 # Relative margin on the cutoffs (against rounding)
+PRUNE_RATIO = 0.5    # Targets are only pruned if they're expected to visit at most this share of the sources
+
+# Span of the world force particles are kept in (within BORDER_STOP), a box this large around any of them covers it
+WORLD_SPAN = 2 * particle.BORDER_STOP
+
+
+def handles(e):
+    """ Returns True if e sums forces like ForceParticle.tick (so skipping sources that apply none is safe). """
+    return force_engine.handles(e)
+
+
+class ForceCutoffs:
+
+    def __init__(self, entities):
+
+        self.entities = entities
+        self.n_entities = len(entities)
+        self.targets = dict() # Target type -> (mask of the sources it always visits, (indices, positions, cutoff) of the ones it may skip)
+
+        always = list() # Indices of the sources every target visits (own mods)
+        sources = dict() # Source type -> indices of the force particles of that type
+        F_min = dict() # Target type -> smallest F_min
+        E_max = dict() # Source type -> largest mass * F_size_mod
+        max_size = 0
+        for ix, e in enumerate(entities):
+            if not isinstance(e, particle.ForceParticle):
+                continue
+            max_size = max(max_size, e.size)
+            if handles(e):
+                F_min[e.type_id] = min(F_min.get(e.type_id, e.F_min), e.F_min)
+            if type_registry.has_type_mods(e):
+                sources.setdefault(e.type_id, list()).append(ix)
+                E_max[e.type_id] = max(E_max.get(e.type_id, 0), e.mass * e.F_size_mod)
+            else:
+                always.append(ix)
+
+        # Repulsion acts within (size + size) * REPEL_RANGE of any pair
+        repel_range = 2 * max_size * particle.REPEL_RANGE
+        n_sources = len(always) + sum(len(s_ix) for s_ix in sources.values())
+
+        positions = dict() # Source type -> (indices, positions), shared by target types
+        for t_type, t_F_min in F_min.items():
+            visited = list(always)
+            near = list()
+            expected = len(always) # Expected amount of candidates (sources spread evenly)
+            for s_type, s_ix in sources.items():
+                cutoff = np.inf
+                if t_F_min > 0:
+                    cutoff = max(np.sqrt(abs(type_registry.MATRIX[s_type][t_type]) * E_max[s_type] / t_F_min), repel_range)
+                    cutoff *= 1 + CUTOFF_MARGIN
+                if cutoff >= WORLD_SPAN:
+                    visited += s_ix
+                    expected += len(s_ix)
+                elif cutoff > 0:
+                    if s_type not in positions:
+                        positions[s_type] = (np.array(s_ix, dtype=np.intp),
+                                             np.array([entities[ix].pos for ix in s_ix], dtype=float).reshape(-1, 2))
+                    near.append(positions[s_type] + (cutoff,))
+                    expected += len(s_ix) * min(1.0, 2 * cutoff / WORLD_SPAN) ** 2
+            if len(near) > 0 and expected <= PRUNE_RATIO * n_sources:
+                mask = np.zeros(self.n_entities, dtype=bool)
+                mask[visited] = True
+                self.targets[t_type] = (mask, near)
+
+    def prunes(self):
+        """ Returns True if some targets can skip most of the sources. """
+        return len(self.targets) > 0
+
+    def candidates(self, p):
+        """ Returns the entities that may apply a force to p (a superset of the ones that do), in simulation order.
+            Returns None if p has to visit every entity.
+        """
+
+        entry = self.targets.get(p.type_id)
+        if entry is None:
+            return None
+
+        mask, near = entry
+        mask = mask.copy()
+        x, y = p.pos
+        for s_ix, s_pos, r in near:
+            inside = np.abs(s_pos[:, 0] - x) <= r
+            inside &= np.abs(s_pos[:, 1] - y) <= r
+            mask[s_ix[inside]] = True
+        entities = self.entities
+        return [entities[ix] for ix in np.flatnonzero(mask).tolist()]
@@ -0,0 +1,318 @@
+"""
+    Vectorized (NumPy) tick for ForceParticle populations.
+    Keeps the particle state in contiguous arrays and computes the force step
+    for all particles at once, instead of calling ForceParticle.tick per particle.
+    The objects stay the reference state: arrays are refreshed from them every tick,
+    so controls, persistence & selection keep working on the particles themselves.
+"""
+import numpy as np
+from Particles.models import particle, barnes_hut, type_registry
+
+
+# Max. amount of pair interactions evaluated at once (bounds memory use)
+BLOCK_SIZE = 1 << 20
+
+
+def handles(e):
+    """ Returns True if e's simulation step is the plain ForceParticle step. """
+    t = type(e)
+    return isinstance(e, particle.ForceParticle) \
+           and t.tick is particle.ForceParticle.tick \
+           and t.finish_tick is particle.ForceParticle.finish_tick \
+           and t.calculate_force is particle.ForceParticle.calculate_force
+
+
+def border_stop(pos):
+    """ Vectorized particle.border_stop. """
+    return np.clip(pos, -particle.BORDER_STOP, particle.BORDER_STOP)
+
+
+def border_push(pos, vel):
+    """ Vectorized particle.border_push. """
+
+    if particle.F_BORDER == 0:
+        return vel.copy()
+
+    border = particle.BORDER_PUSH
+    px, py = pos[:, 0], pos[:, 1]
+    vx, vy = vel[:, 0], vel[:, 1]
+
+    # Wall the particle is moving towards, as line A*x + B*y = C
+    horizontal = np.abs(vx) > np.abs(vy)
+    wall_sign = np.where(horizontal, np.where(vx > 0, 1.0, -1.0), np.where(vy < 0, -1.0, 1.0))
+    A2 = np.where(horizontal, 2 * border, 0.0)
+    B2 = np.where(horizontal, 0.0, 2 * border)
+    C2 = wall_sign * 2 * border * border
+
+    # Line through the particle's current & next position
+    A1 = -vy
+    B1 = vx
+    C1 = (vx * py) - (px * vy)
+
+    D = (A1 * B2) - (B1 * A2)
+    hit = D != 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        b_x = ((C1 * B2) - (B1 * C2)) / D
+        b_y = ((A1 * C2) - (C1 * A2)) / D
+
+        # Vector from wall to particle, reflected along the right axis
+        vec_x = b_x - px
+        vec_y = b_y - py
+        dist_sq = (vec_x * vec_x) + (vec_y * vec_y)
+        swap_y = np.abs(vec_x) > np.abs(vec_y)
+        vec_x, vec_y = np.where(swap_y, vec_x, -vec_x), np.where(swap_y, -vec_y, vec_y)
+
+        F_mag = -(particle.F_BORDER / dist_sq)
+
+    result = vel.copy()
+    result[hit, 0] += F_mag[hit] * vec_x[hit]
+    result[hit, 1] += F_mag[hit] * vec_y[hit]
+    return result
+
+
+# Forces
+
+def block_forces(*args):
+    """ Returns the summed force of the sources on each target (see pair_forces). """
+
+    F, vec = pair_forces(*args)
+    return np.stack(((F * vec[:, :, 0]).sum(axis=1), (F * vec[:, :, 1]).sum(axis=1)), axis=1)
+
+def pair_forces(targets, t_pos, t_size, t_type, t_F_min, t_order, s_pos, s_size, s_mass, s_loaded, s_expiry, mods):
+    """ Returns the (targets x sources) force magnitudes & the vectors they act along. """
+
+    vec = s_pos[None, :, :] - t_pos[:, None, :]
+    dist_sq = (vec[:, :, 0] * vec[:, :, 0]) + (vec[:, :, 1] * vec[:, :, 1])
+
+    # Repelling force at very close range
+    min_dist = (s_size[None, :] + t_size[:, None]) * particle.REPEL_RANGE
+    min_dist *= min_dist
+    close = dist_sq <= min_dist
+    F_repelling = -(s_mass * particle.F_REPEL)[None, :] * (min_dist / (dist_sq + 1e-6))
+
+    # Type based attraction/repulsion
+    with np.errstate(divide='ignore', invalid='ignore'):
+        F = mods[:, t_type].T * (s_mass[None, :] / dist_sq)
+    F[np.abs(F) < t_F_min[:, None]] = 0
+
+    F = np.where(close, F_repelling, F)
+    F[s_loaded[None, :] == targets[:, None]] = 0 # Particles don't act on themselves
+    F[t_order[:, None] > s_expiry[None, :]] = 0
+
+    return F, vec
+
+def direct_forces(targets, t_pos, t_size, t_type, t_F_min, t_order, s_pos, s_size, s_mass, s_loaded, s_expiry, mods):
+    """ Returns the summed force of the sources on each target, in blocks of at most BLOCK_SIZE pairs. """
+
+    forces = np.zeros((len(targets), 2))
+    block = max(1, BLOCK_SIZE // max(len(s_pos), 1))
+    for start in range(0, len(targets), block):
+        end = min(start + block, len(targets))
+        forces[start:end] = block_forces(targets[start:end], t_pos[start:end], t_size[start:end], t_type[start:end],
+                                         t_F_min[start:end], t_order[start:end],
+                                         s_pos, s_size, s_mass, s_loaded, s_expiry, mods)
+    return forces
+
+
+class ForceEngine:
+
+    def __init__(self, theta=None, pool=None):
+
+        # Opening angle of the Barnes-Hut tree, None for exact forces
+        self.theta = theta
+
+        # Worker pool (parallel.WorkerPool) sharing out the direct forces, None to compute them here
+        self.pool = pool
+
+        # Particles ticked by the engine during the current tick & their state
+        self.particles = list()
+        self.pos = np.zeros((0, 2))
+        self.velocity = np.zeros((0, 2))
+        self.mass = np.zeros(0)
+        self.size = np.zeros(0)
+        self.type_id = np.zeros(0, dtype=np.intp)
+        self.paused = np.zeros(0, dtype=bool)
+        self.can_move = np.zeros(0, dtype=bool)
+
+    def handles(self, e):
+        return handles(e)
+
+
+    # Simulation
+
+    def tick(self, entities):
+        """ Computes the new velocity of every particle the engine handles.
+            Counterpart of ForceParticle.tick, for the whole population.
+        """
+
+        self.load([e for e in entities if handles(e)])
+        n = len(self.particles)
+        if n == 0:
+            return
+
+        # Lifetime & lifespan, as done at the start of ForceParticle.tick
+        active = ~self.paused
+        expired = set()
+        for ix in np.flatnonzero(active):
+            p = self.particles[ix]
+            p.lifetime += 1
+            if p.lifespan is not None and p.lifetime > p.lifespan:
+                if not p.mfd:
+                    expired.add(id(p))
+                p.mfd = True
+                active[ix] = False
+
+        # Every force particle acts on the others, engine-handled or not.
+        # Particles expiring this tick still act on the ones ticked before them.
+        sources = list()
+        s_expiry = list()
+        t_order = np.zeros(n, dtype=np.intp)
+        loaded_ix = {id(p): ix for ix, p in enumerate(self.particles)}
+        for e_ix, e in enumerate(entities):
+            if id(e) in loaded_ix:
+                t_order[loaded_ix[id(e)]] = e_ix
+            if not isinstance(e, particle.ForceParticle) or e.paused:
+                continue
+            if id(e) in expired:
+                sources.append(e)
+                s_expiry.append(e_ix)
+            elif not e.mfd:
+                sources.append(e)
+                s_expiry.append(len(entities))
+
+        if len(sources) == 0 or not active.any():
+            self.store_velocity(active)
+            return
+        targets = np.flatnonzero(active)
+        forces = self.calculate_forces(targets, sources, t_order[targets], np.array(s_expiry, dtype=np.intp))
+
+        # Friction, forces & border
+        vel = self.velocity[targets]
+        friction = np.array([self.particles[ix].F_friction for ix in targets])
+        vel *= friction[:, None]
+        vel += np.where(self.can_move[targets, None], forces, 0.0)
+        self.velocity[targets] = border_push(self.pos[targets], vel)
+
+        self.store_velocity(active)
+
+    def finish_tick(self, entities):
+        """ Moves every particle the engine handles. Counterpart of ForceParticle.finish_tick. """
+
+        self.load([e for e in entities if handles(e)])
+        if len(self.particles) == 0:
+            return
+
+        moving = ~self.paused & self.can_move
+        self.pos[moving] = border_stop(self.pos[moving] + self.velocity[moving])
+        for ix, pos in zip(np.flatnonzero(moving), self.pos[moving].tolist()):
+            self.particles[ix].pos = tuple(pos)
+
+
+    # Data management
+
+    def load(self, particles):
+        """ Refreshes the state arrays from the given particles. """
+
+        self.particles = particles
+        self.pos = np.array([p.pos for p in particles], dtype=float).reshape(-1, 2)
+        self.velocity = np.array([p.velocity for p in particles], dtype=float).reshape(-1, 2)
+        self.mass = np.array([p.mass for p in particles], dtype=float)
+        self.size = np.array([p.size for p in particles], dtype=float)
+        self.paused = np.array([p.paused for p in particles], dtype=bool)
+        self.can_move = np.array([p._can_move for p in particles], dtype=bool)
+        self.type_id = np.array([p.type_id for p in particles], dtype=np.intp)
+
+    def store_velocity(self, active):
+        for ix, vel in zip(np.flatnonzero(active), self.velocity[active].tolist()):
+            self.particles[ix].velocity = tuple(vel)
+
+
+    # Forces
+
+    def type_mods(self, sources):
+        """ Returns the (sources x types) matrix of type mods the sources apply to each registered type. """
+        return np.array([s.type_mods for s in sources], dtype=float).reshape(len(sources), type_registry.size())
+
+    def source_arrays(self, sources):
+        """ Returns the state arrays of the sources & the loaded index of each (-1 if not loaded). """
+
+        s_pos = np.array([s.pos for s in sources], dtype=float).reshape(-1, 2)
+        s_size = np.array([s.size for s in sources], dtype=float)
+        s_mass = np.array([s.mass * s.F_size_mod for s in sources], dtype=float)
+
+        loaded_ix = {id(p): ix for ix, p in enumerate(self.particles)}
+        s_loaded = np.array([loaded_ix.get(id(s), -1) for s in sources], dtype=np.intp)
+        return s_pos, s_size, s_mass, s_loaded
+
+    def calculate_forces(self, targets, sources, t_order=None, s_expiry=None):
+        """ Returns the summed force all sources apply to each of the targets (indices into the loaded particles).
+            Follows ForceParticle.calculate_force, including the close range repulsion & the F_min cutoff.
+            A source only acts on targets whose t_order is at most its s_expiry.
+            With theta set, loaded sources with type based mods act through a Barnes-Hut tree.
+        """
+
+        if t_order is None:
+            t_order = np.zeros(len(targets), dtype=np.intp)
+        if s_expiry is None:
+            s_expiry = np.zeros(len(sources), dtype=np.intp)
+
+        t_pos = self.pos[targets]
+        t_size = self.size[targets]
+        t_type = self.type_id[targets]
+        t_F_min = np.array([self.particles[ix].F_min for ix in targets])
+        forces = np.zeros((len(targets), 2))
+
+        # Split off the sources the tree can handle
+        direct = list(range(len(sources)))
+        if self.theta is not None:
+            loaded_ix = {id(p): ix for ix, p in enumerate(self.particles)}
+            in_tree = [s_ix for s_ix, s in enumerate(sources)
+                       if id(s) in loaded_ix and not s.mfd and type_registry.has_type_mods(s)]
+            direct = sorted(set(direct) - set(in_tree))
+
+            if len(in_tree) > 0:
+                tree_ix = np.array([loaded_ix[id(sources[s_ix])] for s_ix in in_tree], dtype=np.intp)
+                s_mass = np.array([sources[s_ix].mass * sources[s_ix].F_size_mod for s_ix in in_tree], dtype=float)
+                # Tree only aggregates the types present
+                present, s_type = np.unique(self.type_id[tree_ix], return_inverse=True)
+                mods = np.array(type_registry.MATRIX, dtype=float)[present]
+                tree = barnes_hut.QuadTree(self.pos[tree_ix], self.size[tree_ix], s_mass, s_type.ravel(),
+                                           len(present), ids=tree_ix)
+                forces += tree.calculate_forces(t_pos, t_size, t_type, t_F_min, targets, mods, self.theta)
+
+        if len(direct) > 0:
+            d_sources = [sources[s_ix] for s_ix in direct]
+            d_expiry = s_expiry[direct]
+            s_pos, s_size, s_mass, s_loaded = self.source_arrays(d_sources)
+            mods = self.type_mods(d_sources)
+            args = (targets, t_pos, t_size, t_type, t_F_min, t_order, s_pos, s_size, s_mass, s_loaded, d_expiry, mods)
+            if self.pool is not None:
+                forces += self.pool.direct_forces(*args)
+            else:
+                forces += direct_forces(*args)
+
+        # Force lines are only kept for particles in debug view
+        debugged = [t_ix for t_ix, ix in enumerate(targets) if self.particles[ix].debug_view]
+        for ix in targets:
+            p = self.particles[ix]
+            if not p.debug_view and len(p.force_lines) > 0:
+                p.force_lines = particle.NO_FORCE_LINES
+        if len(debugged) > 0:
+            s_pos, s_size, s_mass, s_loaded = self.source_arrays(sources)
+            mods = self.type_mods(sources)
+            for t_ix in debugged:
+                p = self.particles[targets[t_ix]]
+                row = slice(t_ix, t_ix + 1)
+                F, vec = pair_forces(targets[row], t_pos[row], t_size[row], t_type[row], t_F_min[row], t_order[row],
+                                           s_pos, s_size, s_mass, s_loaded, s_expiry, mods)
+                f = F[0, :, None] * vec[0]
+                # Only the strongest (see particle.strongest_force_lines)
+                magnitude = np.hypot(f[:, 0], f[:, 1])
+                shown = [s_ix for s_ix, s in enumerate(sources)
+                         if s is not p and t_order[t_ix] <= s_expiry[s_ix] and magnitude[s_ix] > 0]
+                shown.sort(key=lambda s_ix: -magnitude[s_ix])
+                if particle.FORCE_LINES_TOP_K is not None:
+                    shown = shown[:particle.FORCE_LINES_TOP_K]
+                p.force_lines = [(sources[s_ix], tuple(f[s_ix].tolist())) for s_ix in shown]
+
+        return forces
@@ -0,0 +1,176 @@
+"""
+    Parallel ticks for the force engine.
+    Every tick, the engine's snapshot of targets & sources is written to shared memory
+    (multiprocessing.shared_memory). A pool of worker processes, started once & reused
+    every tick, computes the forces for disjoint ranges of targets against that read-only
+    snapshot & writes them to a shared output array.
+    This is safe because of the two-phase tick: nothing moves before finish_tick,
+    so the snapshot doesn't change while the forces are computed.
+"""
+import atexit, multiprocessing, time
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+from Particles.models import force_engine
+from Particles.utils import Logger
+
+
+MIN_TARGETS = 256       # Fewer targets are computed in the main process (not worth the round trip)
+CHUNKS_PER_WORKER = 2   # Target ranges per worker & tick, to even out the load
+
+# Arguments of force_engine.direct_forces, in order
+FORCE_ARGS = ["targets", "t_pos", "t_size", "t_type", "t_F_min", "t_order",
+              "s_pos", "s_size", "s_mass", "s_loaded", "s_expiry", "mods"]
+TARGET_ARGS = FORCE_ARGS[:6]
+
+
+class SharedArrays:
+    """ Named NumPy arrays in shared memory. Blocks are reused across ticks & only reallocated to grow. """
+
+    def __init__(self):
+        self.blocks = dict() # Array name -> SharedMemory
+
+    def array(self, name, shape, dtype):
+        """ Returns an (uninitialised) array of the given shape, backed by the block for name. """
+
+        dtype = np.dtype(dtype)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        block = self.blocks.get(name)
+        if block is None or block.size < nbytes:
+            if block is not None:
+                block.close()
+                block.unlink()
+            # Leave room to grow, so slowly growing populations don't reallocate every tick
+            block = shared_memory.SharedMemory(create=True, size=max(2 * nbytes, 4096))
+            self.blocks[name] = block
+        return np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+    def spec(self, name, arr):
+        """ Returns what a worker needs to attach to the array. """
+        return (self.blocks[name].name, arr.shape, arr.dtype.str)
+
+    def close(self):
+        for block in self.blocks.values():
+            try:
+                block.close()
+                block.unlink()
+            except (BufferError, FileNotFoundError) as e:
+                Logger.log_exception(e)
+        self.blocks = dict()
+
+
+# Worker side
+
+_attached = dict() # Shared memory name -> SharedMemory, per worker process
+
+def _attach(specs):
+    """ Returns the arrays described by specs, attaching to (new) blocks & dropping the ones no longer used. """
+
+    names = set(spec[0] for spec in specs.values())
+    for shm_name in list(_attached.keys()):
+        if shm_name not in names:
+            _attached.pop(shm_name).close()
+
+    arrays = dict()
+    for key, (shm_name, shape, dtype) in specs.items():
+        if shm_name not in _attached:
+            _attached[shm_name] = shared_memory.SharedMemory(name=shm_name)
+        arrays[key] = np.ndarray(shape, dtype=dtype, buffer=_attached[shm_name].buf)
+    return arrays
+
+def _forces_task(task):
+    """ Computes the forces on the targets in [start, end). """
+
+    specs, start, end = task
+    arrays = _attach(specs)
+    # Only target arrays are split, every target sees all sources
+    args = [arrays[key][start:end] if key in TARGET_ARGS else arrays[key] for key in FORCE_ARGS]
+    arrays["forces"][start:end] = force_engine.direct_forces(*args)
+
+
+# Main process side
+
+class WorkerPool:
+
+    def __init__(self, workers):
+
+        self.workers = workers
+        self.shared = SharedArrays()
+        # Workers share the main process' resource tracker, so blocks they attach to aren't
+        # taken for leaked (& unlinked) when they stop
+        resource_tracker.ensure_running()
+        self._pool = multiprocessing.Pool(workers)
+        atexit.register(self.close)
+
+    def direct_forces(self, *args):
+        """ Parallel force_engine.direct_forces: shares the targets out over the workers. """
+
+        n = len(args[0])
+        if self._pool is None or n < MIN_TARGETS:
+            return force_engine.direct_forces(*args)
+
+        # Snapshot of the tick
+        specs = dict()
+        for key, value in zip(FORCE_ARGS, args):
+            arr = self.shared.array(key, value.shape, value.dtype)
+            arr[...] = value
+            specs[key] = self.shared.spec(key, arr)
+        out = self.shared.array("forces", (n, 2), float)
+        specs["forces"] = self.shared.spec("forces", out)
+
+        chunks = min(n, self.workers * CHUNKS_PER_WORKER)
+        bounds = np.linspace(0, n, chunks + 1).astype(int)
+        self._pool.map(_forces_task, [(specs, bounds[c], bounds[c + 1]) for c in range(chunks)])
+        return out.copy()
+
+    def close(self):
+        """ Stops the workers & frees the shared memory. """
+
+        if self._pool is None:
+            return
+        self._pool.terminate()
+        self._pool.join()
+        self._pool = None
+        self.shared.close()
+
+
+# Benchmark
+
+def scaling_benchmark(n=4000, ticks=10, workers=(1, 2, 4, 8), seed=0):
+    """ Logs & returns the avg. tick time of a force scenario, serial & with every amount of workers. """
+
+    import random
+    from Particles.models import simulation
+
+    def avg_tick(sim):
+        sim.tick() # Warm up (starts the workers, allocates the shared memory)
+        starttime = time.perf_counter()
+        for _ in range(ticks):
+            sim.tick()
+        return (time.perf_counter() - starttime) / ticks
+
+    results = dict()
+    for w in [0] + list(workers):
+        random.seed(seed)
+        sim = simulation.setup_force(n)
+        sim.enable_force_engine(workers=w)
+        results[w] = avg_tick(sim)
+        sim.enable_force_engine(False)
+
+    Logger.log("<----------------->")
+    Logger.log("> Parallel tick scaling ({} particles, {} cpus)".format(n, multiprocessing.cpu_count()))
+    for w, t in results.items():
+        Logger.log(">> {} workers: {} ms/tick (speedup {})".format(w if w > 0 else "no", t * 1000, results[0] / t))
+    Logger.log("<----------------->")
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(prog="python -m Particles.models.parallel", description="Parallel tick scaling benchmark.")
+    parser.add_argument("--particles", type=int, default=4000)
+    parser.add_argument("--ticks", type=int, default=10)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+    Logger.set_verbose_level(1)
+    for w, t in scaling_benchmark(args.particles, args.ticks, args.workers).items():
+        print("{} workers: {:.2f} ms/tick".format(w, t * 1000))
@@ -1,14 +1,38 @@
-from Particles.models import entity
-from Particles.utils import Shapes, Transform, DataStructures, Logger, Profiler
-import pyglet, random, math
+from Particles.models import entity, type_registry
+from Particles.utils import Transform, DataStructures, Logger, Profiler
+import random, math, heapq
+
+# Graphics (pyglet, Shapes) are only imported when drawing, so simulations can run headless
 
 
 # Border wrapping functions
+BORDER_STOP = 0.975
+BORDER_PUSH = 1.1
+F_BORDER = 0.000 # 0.0001
+
+# World of automata (wraps around at the border)
+WRAP_BORDER = 1
+WRAP_BUFFER = 0.005
+
+# Close range repulsion between force particles
+REPEL_RANGE = 1.9
+F_REPEL = 50
+
+# Force lines of particles that aren't in debug view (shared, never filled)
+NO_FORCE_LINES = ()
+FORCE_LINES_TOP_K = 16 # Force lines kept per particle in debug view (the strongest), None keeps all
+
+def strongest_force_lines(lines, k=FORCE_LINES_TOP_K):
+    """ Returns the k force lines (e, f) with the strongest non-zero force, strongest first. """
+    lines = [fl for fl in lines if fl[1][0] != 0 or fl[1][1] != 0]
+    if k is None:
+        return lines
+    return heapq.nlargest(k, lines, key=lambda fl: (fl[1][0] * fl[1][0]) + (fl[1][1] * fl[1][1]))
 
 def border_stop(pos):
     wrapped_x = pos[0]
     wrapped_y = pos[1]
-    border = 0.975
+    border = BORDER_STOP
     if pos[0] < -border:
         wrapped_x = -border
     elif pos[0] > border:
@@ -21,8 +45,8 @@ def border_stop(pos):
 
 def border_push(pos, vel):
     # Border pushes back on particle (reflection)
-    F_border = 0.000 # 0.0001
-    border = 1.1
+    F_border = F_BORDER
+    border = BORDER_PUSH
     # Get corners of closest border
     b1 = (0, 0)
     b2 = (0, 0)
@@ -87,6 +111,10 @@ def border_push(pos, vel):
 """
 class Particle(entity.Entity):
 
+    __slots__ = ("velocity", "size", "_can_move")
+
+    CIRCLE_POINTS = 20 # Sides of the circle a particle is drawn as
+
     def __init__(self, x, y, size=0):
 
         super().__init__(x, y)
@@ -96,7 +124,6 @@ class Particle(entity.Entity):
 
         # Graphics
         self.size = size
-        self.debug_view = False
 
         # Other
         self._can_move = True
@@ -104,33 +131,63 @@ class Particle(entity.Entity):
     def finish_tick(self):
         return NotImplementedError
 
+    # Graphics
+
+    def determine_color(self):
+        raise NotImplementedError
+
+    def draw_debug_view(self):
+        """ Draws the debug info of the particle (when debug_view is set). """
+        return
+
 
 """
     Base class for all particles that interact using some (physics-based) force system.
 """
 class ForceParticle(Particle):
 
+    __slots__ = ("lifetime", "mass", "lifespan", "force_lines", "_trail_points", "trail_points_interval", "draw_trail_points")
+
+    # Set per class by the type registry
+    type_id = None
+    type_mods = None
+
+    # Force parameters, shared by all particles of a type (override them per class)
+    F_size_mod = 0.01
+    F_friction = 1
+    F_min = 5e-6
+    interacting_types = dict()
+
+    TRAIL_LENGTH = 150
+    CIRCLE_POINTS = 100
+
     def __init__(self, x=0, y=0, size=0.005, mass=0.005):
 
         super().__init__(x, y, size)
 
+        if not type_registry.is_registered(type(self)):
+            type_registry.compile_mods()
+
         # Particle parameters
         self.lifetime = 0
         self.mass = mass
         self.lifespan = None
-        
-        # Force parameters
-        self.F_size_mod = 0.01
-        self.F_friction = 1
-        self.F_min = 5e-6
-        self.interacting_types = dict()
 
-        # Graphics
-        self.force_lines = list()
-        self.trail_points = DataStructures.LimitedList(150)
+        # Graphics (force lines & trail are only stored while shown)
+        self.force_lines = NO_FORCE_LINES
+        self._trail_points = None
         self.trail_points_interval = 2
         self.draw_trail_points = False
 
+    @property
+    def trail_points(self):
+        """ Previous positions of the particle. Allocated when first used & moved into
+            the simulation's trail buffer (a TrailView) once the trail is shown.
+        """
+        if self._trail_points is None:
+            self._trail_points = DataStructures.LimitedList(self.TRAIL_LENGTH)
+        return self._trail_points
+
     
     # Simulation
 
@@ -147,7 +204,7 @@ class ForceParticle(Particle):
             return
 
         # Calculate forces from other particles
-        self.force_lines = list()
+        self.force_lines = list() if self.debug_view else NO_FORCE_LINES
         # Account for friction
         new_vel_total = (self.velocity[0] * self.F_friction, self.velocity[1] * self.F_friction)
         for e in entities:
@@ -167,6 +224,9 @@ class ForceParticle(Particle):
             if self._can_move:
                 new_vel_total = (new_vel_total[0] + f[0], new_vel_total[1] + f[1])
         
+        if self.debug_view:
+            self.force_lines = strongest_force_lines(self.force_lines)
+
         # Set velocity
         self.velocity = border_push(self.pos, new_vel_total)
         
@@ -174,14 +234,8 @@ class ForceParticle(Particle):
         """ Can be called after Particle.tick to finish operations. """
         if self.paused:
             return
-        
-        # Handling trail drawing
-        if self.draw_trail_points:
-            if (self.lifetime % self.trail_points_interval) == 0:
-                self.trail_points.push(self.pos)
-        elif not self.draw_trail_points and self.trail_points.length() > 0:
-            self.trail_points.pop()
 
+        # Trails are sampled by the simulation (see Simulation.update_trails)
         if self._can_move:
             new_pos = (self.pos[0] + self.velocity[0], self.pos[1] + self.velocity[1])
             self.pos = border_stop(new_pos)
@@ -193,16 +247,16 @@ class ForceParticle(Particle):
             dist_sq = (vec[0] * vec[0]) + (vec[1] * vec[1]) # Calculate it here to omit function call
 
             # Repelling force at very close range
-            min_dist = (e.size + self.size) * 1.9
+            min_dist = (e.size + self.size) * REPEL_RANGE
             min_dist *= min_dist
             if dist_sq <= min_dist:
-                F_mod = 50
+                F_mod = F_REPEL
                 F_sizes = (e.mass * e.F_size_mod)
                 F_repelling = -(F_sizes * F_mod) * ((min_dist / (dist_sq + 1e-6)))
                 return (F_repelling * vec[0], F_repelling * vec[1])
 
             E_mass = (e.mass * e.F_size_mod)
-            F_type_mod = e.calculate_reflect_force(self)
+            F_type_mod = e.type_mods[self.type_id]
             F = F_type_mod * ((E_mass) / (dist_sq))
             if abs(F) < self.F_min:
                 return (0, 0)
@@ -212,39 +266,18 @@ class ForceParticle(Particle):
 
             return result_force
 
-    def calculate_type_mod(self, e):
-
-        result = 0
-        e_type = type(e)
-
-        try:
-            result = self.interacting_types[e_type]
-        except KeyError:
-            # This shouldn't be reachable, but let's be safe
-            Logger.log_warning("Trying to calculate mod for unknown type '{}'.".format(e_type))
-            
-        return result
-
     def calculate_reflect_force(self, e):
-        try:
-            return self.interacting_types[type(e)]
-        except KeyError:
-            # Add reflection mod / 0 for this new type
-            F = 0
-            t_self = type(self)
-            t_e = type(e)
-            if t_self in e.interacting_types:
-                F = e.interacting_types[t_self]
-            self.interacting_types[t_e] = F
-            Logger.log_info("Discovered unknown type {} -> {}".format(t_self, t_e))
-            return F
+        """ Returns the type mod this particle applies to e. Unknown pairs are resolved by the type registry. """
+        return self.type_mods[e.type_id]
 
 
     # Graphics
 
     def draw(self, batch=None):
+        import pyglet
+        from Particles.utils import Shapes
 
-        indices, verts, colors = Shapes.make_circle(center=self.pos, radius=self.size, color=self.determine_color())
+        indices, verts, colors = Shapes.make_circle(n_points=self.CIRCLE_POINTS, center=self.pos, radius=self.size, color=self.determine_color())
 
         if batch is None:
             # Just draw the shape immediately
@@ -256,44 +289,15 @@ class ForceParticle(Particle):
             batch.add_indexed(n, pyglet.gl.GL_TRIANGLES, None, indices, verts, colors)
 
         if self.debug_view:
-            self.draw_force_lines()
-        if self.draw_trail_points:
-            self.draw_trail()      
+            self.draw_debug_view()
 
-    def determine_color(self):
-        raise NotImplementedError
+    def draw_debug_view(self):
+        self.draw_force_lines()
 
     def draw_force_lines(self):
-        """ Draws the a line between particles, thickness depending on the magnitude of the force """
-
-        labels = pyglet.graphics.Batch()
-        for fl in self.force_lines:
-            f = fl[1]
-            e = fl[0]
-            if f[0] == 0 and f[1] == 0:
-                return # If the force is 0, don't draw a line
-
-            t_mod = 7500
-            F = math.sqrt((f[0]*f[0]) + (f[1]*f[1]))
-            line = Shapes.make_line(self.pos, e.pos, thickness=F*t_mod)
-            line.draw(pyglet.gl.GL_LINES)
-
-            # Put label in batch
-            x = (max(e.pos[0], self.pos[0]) + min(e.pos[0], self.pos[0])) / 2.0
-            y = (max(e.pos[1], self.pos[1]) + min(e.pos[1], self.pos[1])) / 2.0
-            label_pos = (x, y)
-            force_text = str(f[0]) + " / " + str(f[1])
-            label = Shapes.make_label(force_text, label_pos, size=10, batch=labels)
-        
-        # Draw batch of labels
-        labels.draw()
-
-    def draw_trail(self):
-        """ Draws the trail of the particle as points in previous positions. """
-
-        n = self.trail_points.length()
-        verts, colors = Shapes.make_points(self.trail_points._list)
-        pyglet.graphics.draw(n, pyglet.gl.GL_POINTS, verts, colors)
+        """ Draws a line to the particles exerting the strongest forces, thickness depending on the magnitude of the force """
+        from Particles.utils import Renderer
+        Renderer.FORCE_LINES.draw([self])
 
 
 """
@@ -301,6 +305,8 @@ class ForceParticle(Particle):
 """
 class PrimordialParticle(Particle):
 
+    __slots__ = ("orientation", "alpha", "beta", "radius", "_neighbourhood_size")
+
     def __init__(self, x, y, vel=0.005, alpha_d=10, beta_d=7, radius=0.1):
 
         super().__init__(x, y, size=0.01)
@@ -322,9 +328,12 @@ class PrimordialParticle(Particle):
             return
         
         # Calculate neighbourhood (sign & amount of neighbours)
+        # (Primordial populations are ticked all at once by primordial_engine, this is its reference)
         N_left = 0
         N_right = 0
         N_total = 0
+        heading = (math.cos(self.orientation) * self.velocity[0], math.sin(self.orientation) * self.velocity[1])
+        radius_sq = self.radius * self.radius
         for e in entities:
 
             if e == self or e.paused:
@@ -333,21 +342,14 @@ class PrimordialParticle(Particle):
             vec = (e.pos[0] - self.pos[0], e.pos[1] - self.pos[1])
             dist_sq = (vec[0] * vec[0]) + (vec[1] * vec[1])
 
-            if dist_sq <= (self.radius * self.radius):
-
-                # Calculate angle between vectors
-                d_x = math.cos(self.orientation) * self.velocity[0]
-                d_y = math.sin(self.orientation) * self.velocity[1]
-                own_vec = (self.pos[0] + d_x, self.pos[1] + d_y)
-                own_vec = (own_vec[0] - self.pos[0], own_vec[1] - self.pos[1])
-                angle = self.calculate_vector_angle(own_vec, vec)
+            if dist_sq <= radius_sq:
 
-                # Check if left or right
-                if 0 < angle and angle < (math.pi / 2.0):
+                # Left or right of the heading: sign of the cross product
+                if (heading[0] * vec[1]) - (heading[1] * vec[0]) > 0:
                     N_left += 1
                 else:
                     N_right += 1
-                N_total += 1 # Count separately because orthogonal matrices still count
+                N_total += 1
         
         sign = 1
         if N_left > N_right:
@@ -370,28 +372,12 @@ class PrimordialParticle(Particle):
         d_y = math.sin(self.orientation) * self.velocity[1]
         self.pos = border_stop((self.pos[0] + d_x, self.pos[1] + d_y))
 
-    def calculate_vector_angle(self, v1, v2):
-        """ Calculates angle between two vectors. """
-        vec_len = lambda v : math.sqrt((v[0] * v[0]) + (v[1] * v[1]))
-        l_v1 = vec_len(v1)
-        l_v2 = vec_len(v2)
-        len_prod = l_v1 * l_v2
-        dot_prod = (v1[0] * v2[0]) + (v1[1] * v2[1])
-        angle = 0.0
-        
-        try:
-            cos = dot_prod / len_prod
-            angle = math.acos(cos)
-        except (ValueError, ZeroDivisionError):
-            pass # Ignore orthogonal vectors
-        return angle
-
-
     # Graphics
     def draw(self, batch=None):
+        import pyglet
+        from Particles.utils import Shapes
 
-        color = self.colors_density()
-        indices, verts, colors = Shapes.make_circle(n_points=20, center=self.pos, radius=self.size, color=color)
+        indices, verts, colors = Shapes.make_circle(n_points=self.CIRCLE_POINTS, center=self.pos, radius=self.size, color=self.determine_color())
 
         if batch is None:
             # Draw directly
@@ -406,6 +392,9 @@ class PrimordialParticle(Particle):
         if self.debug_view:
             self.draw_debug_view()
 
+    def determine_color(self):
+        return self.colors_density()
+
     def colors_heatmap(self):
         color = (
                     45 * self._neighbourhood_size,
@@ -450,6 +439,9 @@ class PrimordialParticle(Particle):
         return color
 
     def draw_debug_view(self):
+        import pyglet
+        from Particles.utils import Shapes
+
         # Draw circle indicating range
         indices, verts, colors = Shapes.make_circle(center=self.pos, radius=self.radius / 2.0)
         # Overwrite degenerate first point
@@ -473,8 +465,14 @@ class PrimordialParticle(Particle):
 """
 class AutomatonParticle(Particle):
 
+    __slots__ = ("radius", "S", "state", "state_phase", "_neighbourhood_size")
+
+    _default_S = None # Statespace shared by default (see setup_statespace)
+
     class ParticleState:
 
+        __slots__ = ("velocity",)
+
         def __init__(self, velocity=(0,0)):
             self.velocity = velocity
 
@@ -500,15 +498,14 @@ class AutomatonParticle(Particle):
             return
 
         # Count neighbours
+        # (Automata populations are ticked all at once by automaton_engine, this is its reference)
         N_total = 0
         for e in entities:
 
             if e == self or e.paused or e.mfd:
                 continue
 
-            # Range check
-            dist_sq = ((e.pos[0] - self.pos[0])**2) + ((e.pos[1] - self.pos[1])**2)
-            if dist_sq < (self.radius * self.radius) or self.check_wrapped_neighbour(e):
+            if self.check_wrapped_neighbour(e):
                 N_total += 1
             
         self._neighbourhood_size = N_total
@@ -522,8 +519,8 @@ class AutomatonParticle(Particle):
         self.pos = self.pos
 
         # Wrap position around if needed
-        border = 1
-        buffer = 0.005
+        border = WRAP_BORDER
+        buffer = WRAP_BUFFER
         if self.pos[0] < -border: 
             self.pos = (border - buffer, self.pos[1])
         elif self.pos[0] > border:
@@ -541,6 +538,8 @@ class AutomatonParticle(Particle):
         return self.S[ix]
 
     def add_state(self, s, ix=None):
+        if self.S is AutomatonParticle._default_S:
+            self.S = list(self.S) # Don't change the shared statespace
         if s not in self.S:
             if ix is None:
                 self.S.append(s)
@@ -551,66 +550,41 @@ class AutomatonParticle(Particle):
                     Logger.log_warning("Can't insert state at position {}.".format(ix))
 
     def setup_statespace(self):
-
-        speed = 0.005
-        # This is where the magic happens
-        s0 = AutomatonParticle.ParticleState((0, 0))
-        self.add_state(s0)
-
-        s1 = AutomatonParticle.ParticleState((0, -speed * 0.5))
-        self.add_state(s1)
-
-        s2 = AutomatonParticle.ParticleState((speed, 0))
-        self.add_state(s2)
-
-        s3 = AutomatonParticle.ParticleState((0, speed))
-        self.add_state(s3)
-
-        s4 = AutomatonParticle.ParticleState((speed*0.5, 0))
-        self.add_state(s4)
-
-        s5 = AutomatonParticle.ParticleState((-speed*0.5, speed*0.5))
-        self.add_state(s5)
-
-        s6 = AutomatonParticle.ParticleState((speed*0.5, -speed*0.5))
-        self.add_state(s6)
+        """ Sets up the default statespace. It's shared by all automata (until one adds a state). """
+
+        if AutomatonParticle._default_S is None:
+            speed = 0.005
+            # This is where the magic happens
+            ParticleState = AutomatonParticle.ParticleState
+            AutomatonParticle._default_S = [
+                                            ParticleState((0, 0)),
+                                            ParticleState((0, -speed * 0.5)),
+                                            ParticleState((speed, 0)),
+                                            ParticleState((0, speed)),
+                                            ParticleState((speed*0.5, 0)),
+                                            ParticleState((-speed*0.5, speed*0.5)),
+                                            ParticleState((speed*0.5, -speed*0.5))
+                                           ]
+        self.S = AutomatonParticle._default_S
 
     def check_wrapped_neighbour(self, e):
-        """ Checks if e is a neighbour of the particle if the world is wrapped. """
-
-        # You only need to check if within radius distance of a wall
-        sign = lambda x : (1, -1)[x < 0]
-
-        # Vertical walls
-        wrapped_x = None
-        wrapped_y = None
-        if self.pos[0] < (-1 + self.radius) or self.pos[0] > (1 - self.radius):
-            # Check if wrapped particle has e as neighbour
-            d_x = 1 - abs(self.pos[0])
-            wrapped_x = (self.pos[0] - (2 * sign(self.pos[0] * d_x)))
-        # Horizontal walls
-        elif self.pos[1] > (1 - self.radius) or self.pos[1] < (-1 + self.radius):
-            d_y = 1 - abs(self.pos[1])
-            wrapped_y = (self.pos[1] - (2 * sign(self.pos[1] * d_y)))
-
-        if wrapped_x is None and wrapped_y is None:
-            return False
-        else:
-            if wrapped_x is None: wrapped_x = self.pos[0]
-            if wrapped_y is None: wrapped_y = self.pos[1]
-            wrapped_pos = (wrapped_x, wrapped_y)
-            dist_sq = ((e.pos[0] - wrapped_pos[0])**2) + ((e.pos[1] - wrapped_pos[1])**2)
-            if dist_sq <= (self.radius * self.radius):
-                return True
-        return False
+        """ Checks if e is a neighbour of the particle in the wrapped world (by the shortest way around). """
+
+        period = 2 * WRAP_BORDER
+        d_x = e.pos[0] - self.pos[0]
+        d_y = e.pos[1] - self.pos[1]
+        d_x -= period * round(d_x / period)
+        d_y -= period * round(d_y / period)
+        return ((d_x * d_x) + (d_y * d_y)) < (self.radius * self.radius)
     
 
 
     # Graphics
     def draw(self, batch=None):
+        import pyglet
+        from Particles.utils import Shapes
 
-        color = self.colors_heatmap() #(40, 10, 120)
-        indices, verts, colors = Shapes.make_circle(n_points=20, center=self.pos, radius=self.size, color=color)
+        indices, verts, colors = Shapes.make_circle(n_points=self.CIRCLE_POINTS, center=self.pos, radius=self.size, color=self.determine_color())
 
         if batch is None:
             # Draw directly
@@ -625,6 +599,9 @@ class AutomatonParticle(Particle):
         if self.debug_view:
             self.draw_debug_view()
     
+    def determine_color(self):
+        return self.colors_heatmap() #(40, 10, 120)
+
     def colors_heatmap(self):
         color = (
                     45 * self._neighbourhood_size,
@@ -635,6 +612,9 @@ class AutomatonParticle(Particle):
         return color
 
     def draw_debug_view(self):
+        import pyglet
+        from Particles.utils import Shapes
+
         # Draw circle indicating range
         indices, verts, colors = Shapes.make_circle(center=self.pos, radius=self.radius / 2.0)
         # Overwrite degenerate first point
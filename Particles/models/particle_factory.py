@@ -1,10 +1,13 @@
 from Particles.utils import Logger
-from Particles.models import types
+from Particles.models import particle, types
 """
     Abstract factory for Particles
     Implemented as a module, instead of a class. This omits extra objects for simple spawning
 """
 
+# Attributes saved for particles that aren't force particles (if they have them)
+PARTICLE_ATTRIBUTES = ["velocity", "radius", "state_phase", "orientation", "alpha", "beta"]
+
 def get_particle_type(name):
     """ Extracts particle type from saved name. Name looks like:
         <class 'Particles.models.types.PType1'>
@@ -22,7 +25,9 @@ def get_particle_type(name):
                     "PType2": types.PType2,
                     "PType3": types.PType3,
                     "PType4": types.PType4,
-                    "PType5": types.PType5
+                    "PType5": types.PType5,
+                    "AutomatonParticle": particle.AutomatonParticle,
+                    "PrimordialParticle": particle.PrimordialParticle
                 }
 
     # Here comes the *big if*
@@ -67,8 +72,13 @@ def create_particle(data):
     
     # Set particle attributes
     try:
-        p.mass = data["mass"]
-        p.velocity = data["velocity"]
+        if isinstance(p, particle.ForceParticle):
+            p.mass = data["mass"]
+            p.velocity = data["velocity"]
+        else:
+            for attr in PARTICLE_ATTRIBUTES:
+                if attr in data:
+                    setattr(p, attr, data[attr])
         p.size = data["size"]
         p._can_move = data["can_move"]
         p.paused = data["paused"]
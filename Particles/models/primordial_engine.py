@@ -0,0 +1,110 @@
+"""
+    Vectorized (NumPy) tick for PrimordialParticle populations.
+    Counts the neighbours left & right of every primordial particle at once, instead of
+    calling PrimordialParticle.tick per particle. Neighbours are found through a cell grid
+    (cells as large as the largest radius) or a Verlet neighbour list kept across ticks,
+    & the side is the sign of the 2-D cross product of the particle's heading & the vector
+    to the neighbour.
+    As with the force engine, the objects stay the reference state: arrays are read from
+    them every tick & the new orientations & neighbourhood sizes are written back.
+"""
+import numpy as np
+from Particles.models import particle
+from Particles.utils import DataStructures
+
+
+# Max. amount of pairs evaluated at once (bounds memory use)
+BLOCK_SIZE = 1 << 20
+
+
+def handles(e):
+    """ Returns True if e's simulation step is the plain PrimordialParticle step. """
+    return isinstance(e, particle.PrimordialParticle) and type(e).tick is particle.PrimordialParticle.tick
+
+
+def near_pairs(t_ix, s_ix, t_pos, t_heading, t_radius, s_pos):
+    """ Returns which (target, source) pairs are within the target's radius, & which of those are on its left.
+        Target & source indices broadcast against each other (e.g. a column of targets & a row of sources).
+    """
+
+    vec_x = s_pos[s_ix, 0] - t_pos[t_ix, 0]
+    vec_y = s_pos[s_ix, 1] - t_pos[t_ix, 1]
+    dist_sq = vec_x * vec_x
+    dist_sq += vec_y * vec_y
+    near = dist_sq <= np.square(t_radius)[t_ix]
+    cross = t_heading[t_ix, 0] * vec_y
+    cross -= t_heading[t_ix, 1] * vec_x
+    left = cross > 0
+    left &= near
+    return near, left
+
+
+def count_neighbours(t_pos, t_heading, t_radius, t_self, s_pos, neighbours=None):
+    """ Returns the amount of sources within the radius of each target, & how many of them are on its left.
+        t_self is the index of each target among the sources (-1 if it isn't one), targets don't count themselves.
+        Candidates come from a grid, or the pairs of neighbours (a DataStructures.VerletList) if given.
+    """
+
+    n = len(t_pos)
+    n_left = np.zeros(n, dtype=np.intp)
+    n_total = np.zeros(n, dtype=np.intp)
+    if n == 0 or len(s_pos) == 0:
+        return n_left, n_total
+
+    if neighbours is not None:
+        t_ix, s_ix = neighbours.pairs(t_pos, t_radius, s_pos)
+        for start in range(0, len(t_ix), BLOCK_SIZE):
+            t_block = t_ix[start:start + BLOCK_SIZE]
+            near, left = near_pairs(t_block, s_ix[start:start + BLOCK_SIZE], t_pos, t_heading, t_radius, s_pos)
+            n_total += np.bincount(t_block[near], minlength=n)
+            n_left += np.bincount(t_block[left], minlength=n)
+    else:
+        for group, sources in DataStructures.grid_blocks(t_pos, s_pos, np.abs(t_radius).max()):
+            block = max(1, BLOCK_SIZE // len(sources))
+            for start in range(0, len(group), block):
+                targets = group[start:start + block]
+                near, left = near_pairs(targets[:, None], sources[None, :], t_pos, t_heading, t_radius, s_pos)
+                n_total[targets] = np.count_nonzero(near, axis=1)
+                n_left[targets] = np.count_nonzero(left, axis=1)
+
+    # A target is always near itself (& never on its own left)
+    n_total -= (t_self >= 0)
+    return n_left, n_total
+
+
+def tick(entities, neighbours=None):
+    """ Turns every primordial particle the engine handles. Counterpart of PrimordialParticle.tick.
+        neighbours is the DataStructures.VerletList kept for them across ticks, if any.
+    """
+
+    particles = [e for e in entities if handles(e) and not (e.paused or e.mfd)]
+    if len(particles) == 0:
+        return
+
+    # Every (unpaused) entity is a neighbour
+    sources = list()
+    source_ix = dict()
+    for e in entities:
+        if not e.paused:
+            source_ix[id(e)] = len(sources)
+            sources.append(e.pos)
+    s_pos = np.array(sources, dtype=float).reshape(-1, 2)
+
+    t_pos = np.array([p.pos for p in particles], dtype=float)
+    orientation = np.array([p.orientation for p in particles], dtype=float)
+    velocity = np.array([p.velocity for p in particles], dtype=float)
+    t_heading = np.stack((np.cos(orientation) * velocity[:, 0], np.sin(orientation) * velocity[:, 1]), axis=1)
+    t_radius = np.array([p.radius for p in particles], dtype=float)
+    t_self = np.array([source_ix.get(id(p), -1) for p in particles], dtype=np.intp)
+
+    n_left, n_total = count_neighbours(t_pos, t_heading, t_radius, t_self, s_pos, neighbours)
+
+    # More on the left turns right & vice versa
+    sign = np.sign(n_total - (2 * n_left))
+    alpha = np.array([p.alpha for p in particles], dtype=float)
+    beta = np.array([p.beta for p in particles], dtype=float)
+    orientation += alpha + (sign * beta * n_total)
+
+    for p, o, n in zip(particles, orientation.tolist(), n_total.tolist()):
+        p.orientation = o
+        p._neighbourhood_size = n
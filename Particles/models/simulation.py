@@ -1,18 +1,38 @@
-from Particles.utils import Logger, Transform, Shapes
-from Particles.models import particle, types
-import pyglet, random, math
+from Particles.utils import Logger, Transform, DataStructures
+from Particles.models import particle, types, type_registry, force_engine, primordial_engine, automaton_engine, force_cutoff
+from Particles.models.types import generator
+import random, math
+import numpy as np
+
+
+INDEX_CELL_SIZE = 0.05  # Cell size of the spatial index (world units)
+NEIGHBOUR_SKIN = 0.02   # Default skin of Verlet neighbour lists (world units, see enable_neighbour_lists)
+CULL_MARGIN = 0.05      # Entities this far out of view are still drawn (covers their size)
 
 class Simulation:
 
     def __init__(self):
 
         # Simulation parameters
-        self.entities = list()
+        self.store = DataStructures.EntityStore()
+        self.trails = DataStructures.TrailBuffer()
         self.lifetime = 0
         self.paused = False
+        self.force_engine = None
+        self.automaton_engine = automaton_engine.AutomatonEngine()
+        self.primordial_neighbours = None # Verlet neighbour list of primordial particles (see enable_neighbour_lists)
+        self.neighbour_grid = None
+        self._spatial_index = None
+        self._max_size = 0 # Largest entity in the spatial index
+
+        # Resolve all type mods up front (once, unless force particle classes were added)
+        type_registry.ensure_compiled()
 
-        # Graphics
-        self.ui = SimulationUI(self)
+        # Graphics (created when first drawn)
+        self.ui = None
+        self.renderer = None
+        self.draw_debug_views = True # Force lines, labels, ...
+        self.trail_stride = 1        # Only every n-th trail point is drawn
 
     # Simulation operations
     def tick(self, dt=1):
@@ -22,92 +42,379 @@ class Simulation:
 
         self.lifetime += 1
 
-        # Keep track of entities to delete
-        to_delete = set()
+        # Force particles are ticked all at once by the engine, if enabled
+        engine = self.force_engine
+        if engine is not None:
+            engine.tick(self.entities)
+
+        # Primordial particles are turned all at once
+        primordial_engine.tick(self.entities, self.primordial_neighbours)
+
+        # Automata (of subclasses) only look for neighbours in the cells around them
+        grid = self.update_neighbour_grid()
 
+        # Force particles ticked one by one only visit the sources within their cutoffs
+        cutoffs = self.force_cutoffs() if engine is None else None
+
+        automata = self.automaton_engine
         for e_ix in range(len(self.entities)):
-            self.entities[e_ix].tick(self.entities)
-            if self.entities[e_ix].mfd:
-                to_delete.add(e_ix)
-        
-        # Cleanup
-        deleted = 0 # Use this for adjusting indices
-        for ix in to_delete:
-            self.entities.pop(ix - deleted)
-            deleted += 1
+            e = self.entities[e_ix]
+            if (engine is not None and engine.handles(e)) or primordial_engine.handles(e) or automata.handles(e):
+                pass # Ticked all at once
+            elif grid is not None and isinstance(e, particle.AutomatonParticle):
+                e.tick(grid.query(e.pos))
+            elif isinstance(e, generator.FieldGenerator):
+                # Fields only act on the entities in their range
+                e.tick(self.entities_within(e.pos, e.range))
+            elif cutoffs is not None and force_cutoff.handles(e):
+                if cutoffs.n_entities != len(self.entities):
+                    cutoffs = self.force_cutoffs() # Entities were added (e.g. emitted) during the tick
+                candidates = cutoffs.candidates(e) if cutoffs is not None else None
+                e.tick(candidates if candidates is not None else self.entities)
+            else:
+                e.tick(self.entities)
+            if e.mfd and e.handle is not None:
+                self.store.remove(e)
+                self.release_trail(e)
+                if self.renderer is not None:
+                    self.renderer.release(e)
+
+        # Automata are ticked all at once, once it's settled which entities are deleted
+        automata.tick(self.entities)
+
+        # Cleanup (one pass, keeps the order)
+        self.store.compact()
+
+        if engine is not None:
+            engine.finish_tick(self.entities)
+        automata.finish_tick()
 
         for e in self.entities:
+            if (engine is not None and engine.handles(e)) or automata.handles(e):
+                continue
             try:
                 e.finish_tick()
             except AttributeError:
                 pass
 
+        self.update_trails()
+        self._spatial_index = None # Entities moved
+
+    def enable_force_engine(self, enabled=True, theta=None, workers=0):
+        """ Switches between ticking ForceParticles one by one & the vectorized (NumPy) engine.
+            With theta set, the engine approximates long range forces with a Barnes-Hut tree.
+            With workers > 0, the (direct) forces are computed by a pool of worker processes.
+        """
+
+        if self.force_engine is not None and self.force_engine.pool is not None:
+            self.force_engine.pool.close()
+
+        if not enabled:
+            self.force_engine = None
+            return
+
+        pool = None
+        if workers > 0:
+            try:
+                from Particles.models import parallel
+                pool = parallel.WorkerPool(workers)
+            except ImportError as ie:
+                Logger.log_warning("Shared memory not available (Python 3.8+). Ticking in a single process.")
+                Logger.log_exception(ie)
+
+        self.force_engine = force_engine.ForceEngine(theta=theta, pool=pool)
+        mode = "" if pool is None else ", {} workers".format(workers)
+        if theta is None:
+            Logger.log_system("Enabled vectorized force engine{}.".format(mode))
+        else:
+            Logger.log_system("Enabled vectorized force engine (Barnes-Hut, theta = {}{}).".format(theta, mode))
+
+    def enable_neighbour_lists(self, enabled=True, skin=NEIGHBOUR_SKIN):
+        """ Switches between finding the neighbours of primordial particles & automata every tick (through a grid) &
+            Verlet neighbour lists, which are kept across ticks & only rebuilt once a particle moved more than half the skin.
+        """
+
+        if not enabled:
+            self.primordial_neighbours = None
+            self.automaton_engine.neighbours = None
+            return
+
+        self.primordial_neighbours = DataStructures.VerletList(skin)
+        self.automaton_engine.neighbours = DataStructures.VerletList(skin, period=2 * particle.WRAP_BORDER)
+        Logger.log_system("Enabled Verlet neighbour lists (skin = {}).".format(skin))
+
+    def neighbour_list_stats(self):
+        """ Returns the stats (rebuilds per tick, ...) of the Verlet neighbour lists in use, by kernel. """
+
+        stats = dict()
+        for name, neighbours in (("primordial", self.primordial_neighbours), ("automata", self.automaton_engine.neighbours)):
+            if neighbours is not None and neighbours.updates > 0:
+                stats[name] = neighbours.stats()
+        return stats
+
+    def update_trails(self):
+        """ Samples the trails of all force particles, from their new positions (one write for all trails). """
+
+        push_slots = list()
+        push_pos = list()
+        fading_slots = list()
+        for e in self.entities:
+            if e.paused or not isinstance(e, particle.ForceParticle):
+                continue
+            trail = e._trail_points
+            if e.draw_trail_points:
+                if not isinstance(trail, DataStructures.TrailView):
+                    trail = self.attach_trail(e)
+                if (e.lifetime % e.trail_points_interval) == 0:
+                    push_slots.append(trail.slot)
+                    push_pos.append(e.pos)
+            elif isinstance(trail, DataStructures.TrailView):
+                # Trails that are turned off fade out
+                fading_slots.append(trail.slot)
+
+        if len(push_slots) > 0:
+            self.trails.push(np.array(push_slots, dtype=np.intp), np.array(push_pos, dtype=float))
+        if len(fading_slots) > 0:
+            self.trails.pop(np.array(fading_slots, dtype=np.intp))
+
+    def attach_trail(self, p):
+        """ Moves p's trail into the simulation's trail buffer (keeping its points & limit). """
+
+        old = p._trail_points
+        if old is None:
+            p._trail_points = self.trails.attach(limit=p.TRAIL_LENGTH)
+        else:
+            p._trail_points = self.trails.attach(old.array() if old.length() > 0 else None, limit=old.limit)
+        return p._trail_points
+
+    def release_trail(self, e):
+        trail = getattr(e, "_trail_points", None)
+        if isinstance(trail, DataStructures.TrailView) and trail.buffer is self.trails:
+            self.trails.release(trail)
+            e._trail_points = None
+
+    def force_cutoffs(self):
+        """ Returns the F_min cutoffs of the force particles (see force_cutoff), or None if they can't skip any pairs. """
+
+        cutoffs = force_cutoff.ForceCutoffs(self.entities)
+        return cutoffs if cutoffs.prunes() else None
+
+    def update_neighbour_grid(self):
+        """ Rebuilds the (wrapping) grid automata count their neighbours in. Cells are as large as the largest radius.
+            Only automata the automaton engine doesn't handle need it.
+        """
+
+        radius = 0
+        for e in self.entities:
+            if isinstance(e, particle.AutomatonParticle) and not self.automaton_engine.handles(e):
+                radius = max(radius, e.radius)
+
+        if radius <= 0:
+            self.neighbour_grid = None
+        else:
+            self.neighbour_grid = DataStructures.SpatialHash(radius, wrap=True)
+            self.neighbour_grid.rebuild(self.entities)
+        return self.neighbour_grid
+
+    # Spatial queries
+    def spatial_index(self):
+        """ Returns a grid of all entities by position. It's only rebuilt when asked for after a tick or adding entities.
+            Entities only move in finish_tick, so the grid holds for the whole of a tick.
+        """
+
+        if self._spatial_index is None:
+            self._spatial_index = DataStructures.SpatialHash(INDEX_CELL_SIZE)
+            self._spatial_index.rebuild(self.entities)
+            self._max_size = max([getattr(e, "size", 0) for e in self.entities], default=0)
+        return self._spatial_index
+
+    def entities_in_rect(self, low, high):
+        """ Returns the entities positioned within the rectangle from low (x, y) to high (x, y). """
+
+        candidates = self.spatial_index().query_rect(low, high)
+        return [e for e in candidates if low[0] <= e.pos[0] <= high[0] and low[1] <= e.pos[1] <= high[1]]
+
+    def entities_within(self, pos, r):
+        """ Returns the entities positioned within r of pos. """
+        return self.spatial_index().query_radius(pos, r)
+
+    def closest_entity(self, pos, r):
+        """ Returns the entity whose edge is closest to pos, if within r (e.g. the one under the mouse), or None. """
+
+        index = self.spatial_index()
+
+        # Entities without a size (not selectable) are never the closest
+        edge_dist = lambda e: (Transform.dist(pos, e.pos) - e.size) if hasattr(e, "size") else math.inf
+        return index.nearest(pos, r, edge_dist, self._max_size)
+
+    def entities_in_view(self):
+        """ Returns the entities within the camera's view (see Transform). """
+
+        low, high = Transform.get_view_bounds(CULL_MARGIN)
+        if low[0] <= -1 and low[1] <= -1 and high[0] >= 1 and high[1] >= 1:
+            return self.entities # All of the world is in view
+        return self.entities_in_rect(low, high)
+
     # Data management
+    @property
+    def entities(self):
+        """ Entities in the simulation, in order of adding. """
+        return self.store.entities
+
     def add_entity(self, entity):
-        """ Adds an entity to the simulation. """
-        self.entities.append(entity)
+        """ Adds an entity to the simulation & returns its handle. """
+        handle = self.store.add(entity)
+        if self.neighbour_grid is not None:
+            self.neighbour_grid.insert(entity)
+        self._spatial_index = None
+        return handle
+
+    def get_entity(self, handle):
+        """ Returns the entity of a handle, or None if it's no longer in the simulation. """
+        return self.store.get(handle)
+
+    def clear_entities(self):
+        self.store.clear()
+        self.trails = DataStructures.TrailBuffer()
+        self._spatial_index = None
+        if self.renderer is not None:
+            self.renderer.clear()
     
     # Graphics
     def draw(self):
-        # Draw entities
+        import pyglet
+
+        # Draw trails (all at once, below the particles)
+        trailed = [e._trail_points.slot for e in self.entities
+                   if isinstance(e, particle.ForceParticle) and e.draw_trail_points
+                   and isinstance(e._trail_points, DataStructures.TrailView)]
+        if len(trailed) > 0:
+            from Particles.utils import Shapes
+            points = self.trails.points(trailed)[::self.trail_stride]
+            if len(points) > 0:
+                trails = Shapes.make_points_from_arrays([points])
+                trails.draw(pyglet.gl.GL_POINTS)
+                trails.delete()
 
-        B_entities = pyglet.graphics.Batch()        
-        [e.draw(batch=B_entities) for e in self.entities]      
-            
-        B_entities.draw()        
+        # Draw entities in view: debug views first, then the particles from the persistent batch
+        from Particles.utils import Renderer
+        if self.renderer is None:
+            self.renderer = Renderer.ParticleRenderer()
+        particles = list()
+        force_debugged = list()
+        for e in self.entities_in_view():
+            if isinstance(e, particle.Particle):
+                particles.append(e)
+                if not e.debug_view or not self.draw_debug_views:
+                    continue
+                if isinstance(e, particle.ForceParticle):
+                    force_debugged.append(e) # Force lines are drawn all at once
+                else:
+                    e.draw_debug_view()
+            else:
+                e.draw()
+        if len(force_debugged) > 0 or len(Renderer.FORCE_LINES.labels) > 0:
+            Renderer.FORCE_LINES.draw(force_debugged)
+        self.renderer.update(particles)
+        self.renderer.draw()
         
         # Draw UI
+        if self.ui is None:
+            self.ui = SimulationUI(self)
         self.ui.draw()
 
 
 class SimulationUI:
+    """ HUD of the simulation. Labels are drawn from one batch & only updated when their value changes. """
 
     class UILabel:
 
-        def __init__(self, pos, text, size=18):
+        def __init__(self, pos, text, size=18, batch=None):
             self.pos = pos
             self.text = text
             self.size = size
 
-            screenpos = Transform.world_to_screen(self.pos)
-            self.label = pyglet.text.Label(self.text, font_name='Arial', font_size=self.size,
-                                            x=screenpos[0], y=screenpos[1],
-                                            anchor_x='left', anchor_y='center')
+            from Particles.utils import Shapes
+            self.label = Shapes.make_label(self.text, self.pos, self.size, anchor_x='left', anchor_y='center',
+                                           batch=batch, camera=False)
+            self._win_size = (Transform.WIN_WIDTH, Transform.WIN_HEIGHT)
 
-        def draw(self):
-            self.label.draw()
+        def set_text(self, text):
+            if text != self.text:
+                self.text = text
+                self.label.text = text
+
+        def refresh(self):
+            """ Moves the label along if the window was resized (labels are placed in pixels). """
+            win_size = (Transform.WIN_WIDTH, Transform.WIN_HEIGHT)
+            if win_size != self._win_size:
+                self.label.begin_update()
+                self.label.x, self.label.y = Transform.world_to_screen(self.pos, camera=False)
+                self.label.end_update()
+                self._win_size = win_size
 
 
     def __init__(self, sim):
 
+        import pyglet
         self.sim = sim
+        self.batch = pyglet.graphics.Batch()
 
         # Elements
-        self.time_label = SimulationUI.UILabel((-0.925, -0.8), 'Time', size=14)
-        self.entity_count = SimulationUI.UILabel((-0.925, -0.875), 'Entities', size=14)
+        self.time_label = SimulationUI.UILabel((-0.925, -0.8), 'Time', size=14, batch=self.batch)
+        self.entity_count = SimulationUI.UILabel((-0.925, -0.875), 'Entities', size=14, batch=self.batch)
+        self.labels = [self.time_label, self.entity_count]
+
+        # Values shown
+        self._lifetime = None
+        self._entities = None
     
 
     def draw(self):
-        
-        self.time_label.label.text = "Time: " + str(self.sim.lifetime)
-        self.time_label.draw()
 
-        self.entity_count.label.text = "Entities: " + str(len(self.sim.entities))
-        self.entity_count.draw()
+        if self.sim.lifetime != self._lifetime:
+            self._lifetime = self.sim.lifetime
+            self.time_label.set_text("Time: " + str(self._lifetime))
+
+        if len(self.sim.entities) != self._entities:
+            self._entities = len(self.sim.entities)
+            self.entity_count.set_text("Entities: " + str(self._entities))
+
+        for label in self.labels:
+            label.refresh()
+        self.batch.draw()
     
 
 
 def setup():
+    """ Simulation the app starts with (paused). """
+
+    sim = setup_automata(75)
+    sim.paused = True
+
+    return sim
+
+def setup_force(n=400, active_types=None):
+    """ Force particles of random types, spread over the world. """
 
     sim = Simulation()
+    if active_types is None:
+        active_types = [types.PType1, types.PType2, types.PType3, types.PType4]
 
-    # Create particles
-    active_types = [types.PType1, types.PType2, types.PType3, types.PType4]
-    sim.paused = True
+    for _ in range(n):
+        x = (random.randint(10, 190) - 100) / 100.0
+        y = (random.randint(10, 190) - 100) / 100.0
+        p = random.choice(active_types)(x, y)
+        sim.add_entity(p)
+
+    return sim
 
-    # Primordial particles
-    """
-    for _ in range(1000):
+def setup_primordial(n=1000):
+    """ Primordial particles. """
+
+    sim = Simulation()
+
+    for _ in range(n):
         x = (random.randint(10, 190) - 100) / 100.0
         y = (random.randint(10, 190) - 100) / 100.0
         size = 0.007
@@ -118,11 +425,15 @@ def setup():
         p = particle.PrimordialParticle(x, y, vel=velocity, alpha_d=alpha, beta_d=beta, radius=radius)
         p.size = size
         sim.add_entity(p)
-    
-    """
 
-    # Particle Automaton
-    for _ in range(75):
+    return sim
+
+def setup_automata(n=75):
+    """ Particle automata. """
+
+    sim = Simulation()
+
+    for _ in range(n):
         x = (random.randint(15, 185) - 100) / 100.0
         y = (random.randint(15, 185) - 100) / 100.0
         radius = 0.05
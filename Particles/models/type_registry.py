@@ -0,0 +1,97 @@
+"""
+    Registry of force particle types.
+    Gives every ForceParticle class a small integer id (cls.type_id) and compiles the
+    interacting_types tables of all classes into one dense matrix of type mods:
+        MATRIX[s][t] = mod a particle of type s applies to a particle of type t
+    Every class gets its row as cls.type_mods, so looking up a mod is a list index.
+    Particles with their own mods (generators, emitters, random types) own a ModRow instead.
+    Pairs missing from the tables are resolved once, when compiling, the same way
+    ForceParticle.calculate_reflect_force used to discover them.
+"""
+import weakref
+from Particles.utils import Logger
+
+
+CLASSES = list() # Registered classes, by id
+MATRIX = list()
+
+_instance_rows = weakref.WeakValueDictionary() # id -> ModRow
+
+
+class ModRow(list):
+    """ Row of type mods owned by a single particle. Grows with the registry, padded with default. """
+
+    def __init__(self, values=(), default=0.0):
+        super().__init__(values)
+        self.default = default
+
+
+def instance_row(default=0.0):
+    """ Returns a new row for a particle with its own mods, with every mod set to default. """
+    row = ModRow([default] * len(CLASSES), default)
+    _instance_rows[id(row)] = row
+    return row
+
+def size():
+    return len(CLASSES)
+
+def is_registered(cls):
+    return cls.__dict__.get("type_id") is not None
+
+def has_type_mods(p):
+    """ Returns True if p uses the mods of its type (instead of its own). """
+    return p.type_mods is MATRIX[p.type_id]
+
+
+def force_particle_classes():
+    """ Returns all (currently defined) ForceParticle classes, base first. """
+
+    from Particles.models import particle
+    from Particles.models.types import emitter, generator, rand_type
+
+    result = list()
+    stack = [particle.ForceParticle]
+    while len(stack) > 0:
+        cls = stack.pop(0)
+        if cls not in result:
+            result.append(cls)
+            stack += cls.__subclasses__()
+    return result
+
+def ensure_compiled():
+    """ Compiles the mods if some force particle class isn't registered yet (e.g. it was defined since). """
+    if not all(is_registered(cls) for cls in force_particle_classes()):
+        compile_mods()
+
+def compile_mods():
+    """ Registers all force particle classes & (re)builds the mod matrix. Existing rows are updated in place.
+        Call it again after changing the interacting_types of a class.
+    """
+
+    for cls in force_particle_classes():
+        if not is_registered(cls):
+            cls.type_id = len(CLASSES)
+            CLASSES.append(cls)
+
+    tables = [dict(cls.interacting_types) for cls in CLASSES]
+
+    unknown = 0
+    for s_ix, s in enumerate(CLASSES):
+        row = list()
+        for t_ix, t in enumerate(CLASSES):
+            if t in tables[s_ix]:
+                row.append(tables[s_ix][t])
+            else:
+                # Reflect the mod of the other type, or 0
+                row.append(tables[t_ix].get(s, 0))
+                unknown += 1
+        if s_ix < len(MATRIX):
+            MATRIX[s_ix][:] = row
+        else:
+            MATRIX.append(row)
+        s.type_mods = MATRIX[s_ix]
+
+    for row in list(_instance_rows.values()):
+        row += [row.default] * (len(CLASSES) - len(row))
+
+    Logger.log_info("Compiled type mods for {} types ({} pairs resolved without mod).".format(len(CLASSES), unknown))
@@ -4,14 +4,11 @@ from Particles.utils import Transform
 
 class PType1(particle.ForceParticle):
 
+    __slots__ = ()
+
     def __init__(self, x=0, y=0, size=0.008, mass=0.1):
 
         super().__init__(x, y, size, mass)
-        self.interacting_types = {
-                                  PType1: -0.8,
-                                  PType2: 1.5, 
-                                  PType3: -1.5
-                                 }
        
 
     # Graphics
@@ -22,14 +19,11 @@ class PType1(particle.ForceParticle):
 
 class PType2(particle.ForceParticle):
 
+    __slots__ = ()
+
     def __init__(self, x=0, y=0, size=0.007, mass=0.085):
 
         super().__init__(x, y, size, mass)
-        self.interacting_types = {
-                                  PType1: -1.2,
-                                  PType2: 1.5, 
-                                  PType3: 1.25
-                                 }
 
 
     # Graphics
@@ -40,14 +34,11 @@ class PType2(particle.ForceParticle):
 
 class PType3(particle.ForceParticle):
 
+    __slots__ = ()
+
     def __init__(self, x=0, y=0, size=0.0055, mass=0.06):
 
         super().__init__(x, y, size, mass)
-        self.interacting_types = {
-                                  PType1: -0.75,
-                                  PType2: -0.8, 
-                                  PType3: 1.2
-                                 }
 
 
     # Graphics
@@ -58,15 +49,11 @@ class PType3(particle.ForceParticle):
 
 class PType4(particle.ForceParticle):
 
+    __slots__ = ()
+
     def __init__(self, x=0, y=0, size=0.0035, mass=0.03):
 
         super().__init__(x, y, size, mass)
-        self.interacting_types = {
-                                  PType1: 0.125,
-                                  PType2: -0.3, 
-                                  PType3: -0.05,
-                                  PType4: 0.15
-                                 }
 
 
     # Graphics
@@ -77,16 +64,42 @@ class PType4(particle.ForceParticle):
 
 class PType5(particle.ForceParticle):
 
+    __slots__ = ()
+
     def __init__(self, x=0, y=0, size=0.004, mass=0.005):
         
         super().__init__(x, y, size, mass)
-        self.interacting_types = {
-                                  PType4: 1, 
-                                  PType5: -0.25
-                                 }
 
 
     # Graphics
 
     def determine_color(self):
         return (200, 20, 120)
+
+
+# Type mods (set after all types exist, since they refer to each other)
+PType1.interacting_types = {
+                             PType1: -0.8,
+                             PType2: 1.5,
+                             PType3: -1.5
+                            }
+PType2.interacting_types = {
+                             PType1: -1.2,
+                             PType2: 1.5,
+                             PType3: 1.25
+                            }
+PType3.interacting_types = {
+                             PType1: -0.75,
+                             PType2: -0.8,
+                             PType3: 1.2
+                            }
+PType4.interacting_types = {
+                             PType1: 0.125,
+                             PType2: -0.3,
+                             PType3: -0.05,
+                             PType4: 0.15
+                            }
+PType5.interacting_types = {
+                             PType4: 1,
+                             PType5: -0.25
+                            }
@@ -1,4 +1,4 @@
-from Particles.models import particle
+from Particles.models import particle, type_registry
 from Particles.utils import Transform
 import random, math
 
@@ -14,6 +14,11 @@ class Emitter(particle.ForceParticle):
         self._has_emitted = False
         self._particles_emitted = 0
 
+        # Force parameters (setting PType or F_push updates the type mods)
+        self.type_mods = type_registry.instance_row()
+        self._PType = None
+        self._F_push = 0.0005
+
         # Emitter properties
         self.sim = sim
         self.PType = PType
@@ -23,9 +28,6 @@ class Emitter(particle.ForceParticle):
         self.PLifespan = None
         self.PLimit = None
 
-        # Force parameters
-        self.F_push = 0.0005
-
     
     def emit(self):
 
@@ -61,13 +63,33 @@ class Emitter(particle.ForceParticle):
         elif self._has_emitted and (em_timer >= -0.6 and em_timer <= 0.6):
             self._has_emitted = False
 
-    
-    def calculate_reflect_force(self, e):
 
-        if type(e) is self.PType:
-            return -self.F_push
-        else:
-            return 0.0
+    @property
+    def PType(self):
+        return self._PType
+
+    @PType.setter
+    def PType(self, PType):
+        self._PType = PType
+        self.update_type_mods()
+
+    @property
+    def F_push(self):
+        return self._F_push
+
+    @F_push.setter
+    def F_push(self, F):
+        self._F_push = F
+        self.update_type_mods()
+
+    def update_type_mods(self):
+        """ Only pushes away its own type. """
+
+        self.type_mods[:] = [0.0] * len(self.type_mods)
+        if self.PType is not None:
+            if not type_registry.is_registered(self.PType):
+                type_registry.compile_mods()
+            self.type_mods[self.PType.type_id] = -self.F_push
 
     
     # Graphics
@@ -1,6 +1,5 @@
-from Particles.models import entity, particle
-from Particles.utils import Shapes, Transform
-from pyglet import graphics, gl
+from Particles.models import entity, particle, type_registry
+from Particles.utils import Transform
 
 
 """
@@ -14,6 +13,7 @@ class Generator(particle.ForceParticle):
 
         self.F_generated = force
         self.fluct_func = None
+        self.type_mods = type_registry.instance_row(force)
 
 
     # Simulation
@@ -23,18 +23,21 @@ class Generator(particle.ForceParticle):
         self.lifetime += 1
 
         if self.fluct_func is not None:
-            self.F_generated = self.fluct_func(self.lifetime)
+            self.set_force(self.fluct_func(self.lifetime))
 
     def calculate_force(self, e):
         # A generator isn't acted upon
         return (0, 0)
 
-    def calculate_reflect_force(self, e):
-        return self.F_generated
-
     def set_fluct_func(self, f):
         self.fluct_func = f
 
+    def set_force(self, F):
+        """ Sets the generated force, which applies to all types alike. """
+        self.F_generated = F
+        self.type_mods[:] = [F] * len(self.type_mods)
+        self.type_mods.default = F
+
 
     # Graphics
 
@@ -62,16 +65,18 @@ class FieldGenerator(entity.Entity):
     
     # Simulation
     def tick(self, entities):
+        # The simulation only passes the entities in range (see Simulation.entities_within)
 
         if self.paused or self.mfd:
             return
 
+        range_squared = self.range * self.range
         for e in entities:
 
             try:
                 # Add force to particle velocity
-                if Transform.dist(self.pos, e.pos) <= self.range:
-                    e._velocity = (e._velocity[0] + self.F[0], e._velocity[1] + self.F[1])
+                if Transform.dist_squared(self.pos, e.pos) <= range_squared:
+                    e.velocity = (e.velocity[0] + self.F[0], e.velocity[1] + self.F[1])
             except AttributeError:
                 # Not a particle, ignore
                 continue
@@ -82,6 +87,9 @@ class FieldGenerator(entity.Entity):
         # Fields are invisible, but debug is possible
 
         if self.debug_view:
+            from pyglet import graphics, gl
+            from Particles.utils import Shapes
+
             n_points = 40
             anchor = (self.pos[0] - (self.range / 2.0), self.pos[1] + (self.range / 2.0))
             indices, verts, colors = Shapes.make_circle(n_points=n_points, center=self.pos, radius=(self.range / 2.0))
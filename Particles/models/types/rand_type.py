@@ -1,4 +1,4 @@
-from Particles.models import particle
+from Particles.models import particle, type_registry
 import random
 
 """
@@ -12,6 +12,7 @@ class RandomType(particle.ForceParticle):
 
         self.mods = dict()
         self.color_mod = random.randint(40, 100) / 100.0
+        self.type_mods = type_registry.instance_row()
 
     
     def setup_mods(self, types):
@@ -21,20 +22,11 @@ class RandomType(particle.ForceParticle):
             m = (100 - random.randint(0, 200)) / 100.0
             self.mods[t] = m
 
-        self.interacting_types = types
-
-
-    # Simulation
-
-    def calculate_type_mod(self, e):
-
-        result = 0.0
-        try:
-            result = self.mods[type(e)]
-        except KeyError:
-            pass
-        
-        return result
+        self.interacting_types = self.mods
+        for t, m in self.mods.items():
+            if not type_registry.is_registered(t):
+                type_registry.compile_mods()
+            self.type_mods[t.type_id] = m
 
     
     # Graphics
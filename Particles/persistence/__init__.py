@@ -3,7 +3,7 @@
     Provides functionality for saving and loading simulation states.
 """
 import os, json
-from Particles.app import CONFIG
+from Particles.config import CONFIG
 from Particles.models import particle, types, particle_factory
 from Particles.utils import Logger
 
@@ -33,57 +33,53 @@ def set_data_folder(path):
 
 
 # Saving and loading
-def save_to_json(sim, fname="sim"):
-    """ Saves a simulation's state as a .json file. """
-
-    fname = get_file_path(fname, "json")
-
-    with open(fname, 'w') as savefile:
-
-        # Collect all data to be saved
-        data = {
-                "lifetime": sim.lifetime,
-                "particles": list()
-               }
-
-        # Go over each entity and save its properties
-        for e in sim.entities:
-
-            if issubclass(type(e), particle.ForceParticle):
-                try:
-                    p_data = dict()
-                    p_data["type"] = str(type(e))
-                    p_data["pos"] = e.pos
-                    p_data["velocity"] = e.velocity
-                    p_data["mass"] = e.mass
-                    p_data["size"] = e.size
-                    p_data["can_move"] = e._can_move
-                    p_data["paused"] = e.paused
-                    data["particles"].append(p_data)
-                except AttributeError as e:
-                    Logger.log_warning("Corrupt particle. Can't save particle.")
-                    Logger.log_exception(e)
-                    continue
-
-        # Dump data to json
-        json.dump(data, savefile)
-
-
-def load_from_json(sim, fname="sim"):
-    """ Loads a simulation state. """
-
-    fname = get_file_path(fname, "json")
-
-    if not os.path.exists(fname):
-        Logger.log_error("File not found: '{}'. Can't load.".format(fname))
-        return
-
-    data = dict()
-    with open(fname, 'r') as savefile:
-        data = json.load(savefile)
+def get_state(sim):
+    """ Returns a simulation's state as (JSON serializable) data. """
+
+    # Collect all data to be saved
+    data = {
+            "lifetime": sim.lifetime,
+            "particles": list()
+           }
+
+    # Go over each entity and save its properties
+    for e in sim.entities:
+
+        if issubclass(type(e), particle.ForceParticle):
+            try:
+                p_data = dict()
+                p_data["type"] = str(type(e))
+                p_data["pos"] = e.pos
+                p_data["velocity"] = e.velocity
+                p_data["mass"] = e.mass
+                p_data["size"] = e.size
+                p_data["can_move"] = e._can_move
+                p_data["paused"] = e.paused
+                data["particles"].append(p_data)
+            except AttributeError as e:
+                Logger.log_warning("Corrupt particle. Can't save particle.")
+                Logger.log_exception(e)
+                continue
+
+        elif issubclass(type(e), particle.Particle):
+            p_data = dict()
+            p_data["type"] = str(type(e))
+            p_data["pos"] = e.pos
+            p_data["size"] = e.size
+            p_data["can_move"] = e._can_move
+            p_data["paused"] = e.paused
+            for attr in particle_factory.PARTICLE_ATTRIBUTES:
+                if hasattr(e, attr):
+                    p_data[attr] = getattr(e, attr)
+            data["particles"].append(p_data)
+
+    return data
+
+def set_state(sim, data):
+    """ Replaces a simulation's state by the given data. """
 
     # Clear previous state
-    sim.entities.clear()
+    sim.clear_entities()
     
     # Construct sim state
     sim.lifetime = data["lifetime"]
@@ -95,3 +91,30 @@ def load_from_json(sim, fname="sim"):
             sim.add_entity(p)
         else:
             Logger.log_warning("Loading particle failed.")
+
+def save_to_json(sim, fname="sim", path=None):
+    """ Saves a simulation's state as a .json file. Saved in the data folder, unless a path is given. """
+
+    if path is None:
+        path = get_file_path(fname, "json")
+
+    with open(path, 'w') as savefile:
+        # Dump data to json
+        json.dump(get_state(sim), savefile)
+
+
+def load_from_json(sim, fname="sim", path=None):
+    """ Loads a simulation state. Loaded from the data folder, unless a path is given. """
+
+    if path is None:
+        path = get_file_path(fname, "json")
+
+    if not os.path.exists(path):
+        Logger.log_error("File not found: '{}'. Can't load.".format(path))
+        return
+
+    data = dict()
+    with open(path, 'r') as savefile:
+        data = json.load(savefile)
+
+    set_state(sim, data)
@@ -1,60 +1,560 @@
+import numpy as np
+
+
 
 """
     A list that can hold a limited amount of items.
     When appending new items if the list is full, the oldest
     items are dropped.
+    Items are fixed size vectors of floats (e.g. positions), kept in a circular
+    NumPy buffer, so pushing & dropping the oldest item are O(1).
 """
 class LimitedList:
 
-    def __init__(self, limit=10):
+    def __init__(self, limit=10, width=2):
 
         self.limit = limit
-        self._list = list()
+        self.width = width
+        self._data = np.zeros((limit, width))
+        self._start = 0 # Index of the oldest item
+        self._length = 0
 
     def push(self, el):
 
-        if len(self._list) < self.limit:
-            self._list.append(el)
+        if self._length < self.limit:
+            self._data[(self._start + self._length) % self.limit] = el
+            self._length += 1
         else:
-            # Drop item 0, append new item
-            self._list.pop(0)
-            self._list.append(el)
+            # Overwrite the oldest item
+            self._data[self._start] = el
+            self._start = (self._start + 1) % self.limit
 
     def length(self):
-        return len(self._list)
+        return self._length
 
     def pop(self, ix=None):
         if ix is None:
             ix = 0
-        try:
-            self._list.pop(ix)
-        except:
-            raise KeyError("Popping item {} in list of length {}".format(ix, len(self._list)))
+        ix = self._index(ix, "Popping")
+
+        if ix == 0:
+            self._start = (self._start + 1) % self.limit
+        elif ix < self._length - 1:
+            # Close the gap (only the items after ix move)
+            items = self.array()
+            self._data[:self._length - 1] = np.delete(items, ix, axis=0)
+            self._start = 0
+        self._length -= 1
 
     def clear(self):
-        self._list = list()
+        self._start = 0
+        self._length = 0
 
     def set_limit(self, l):
         """ Changes the limit. If reduced, pops elements that don't fit. """
         if l <= 0:
             raise Exception("Can't set LimitedList limit to 0.")
-        
-        if l < self.limit:
-            last_ix = self.limit - l
-            self.limit = l
-            self._list = self._list[last_ix:]
-        else:
-            self.limit = l
 
+        items = self.array()[-l:]
+        self.limit = l
+        self._data = np.zeros((l, self.width))
+        self._data[:len(items)] = items
+        self._start = 0
+        self._length = len(items)
+
+    def segments(self):
+        """ Returns the items (oldest first) as at most two views on the buffer, without copying. """
+
+        end = self._start + self._length
+        if end <= self.limit:
+            return [self._data[self._start:end]]
+        return [self._data[self._start:], self._data[:end - self.limit]]
+
+    def array(self):
+        """ Returns a (contiguous) copy of the items, oldest first. """
+        return np.concatenate(self.segments())
+
+    def _index(self, ix, action):
+        if ix < 0:
+            ix += self._length
+        if ix < 0 or ix >= self._length:
+            raise KeyError("{} item {} in list of length {}".format(action, ix, self._length))
+        return ix
 
     def __getitem__(self, ix):
-        try:
-            return self._list[ix]
-        except:
-            raise KeyError("Requested index {} in list of length {}.".format(ix, len(self._list)))
+        ix = self._index(ix, "Requested")
+        return tuple(self._data[(self._start + ix) % self.limit].tolist())
 
     def __setitem__(self, ix, item):
+        ix = self._index(ix, "Setting")
+        self._data[(self._start + ix) % self.limit] = item
+
+
+"""
+    Uniform grid that buckets items by their position.
+    Any item within cell_size of a position is found in the 3x3 cells around it.
+    If wrap is set, the grid treats the world as periodic (edges wrap around).
+"""
+class SpatialHash:
+
+    def __init__(self, cell_size, low=-1, high=1, wrap=False):
+
+        if cell_size <= 0:
+            raise Exception("Can't make SpatialHash with cell size {}.".format(cell_size))
+
+        self.low = low
+        self.high = high
+        self.wrap = wrap
+        self.n = max(1, int((high - low) / cell_size))
+        self.cell_size = (high - low) / self.n
+        self.cells = dict()
+
+    def cell(self, pos):
+        """ Returns the (x, y) index of the cell pos falls in. Positions outside the grid get the closest cell. """
+        cx = int((pos[0] - self.low) / self.cell_size)
+        cy = int((pos[1] - self.low) / self.cell_size)
+        cx = min(max(cx, 0), self.n - 1)
+        cy = min(max(cy, 0), self.n - 1)
+        return (cx, cy)
+
+    def insert(self, item):
+        self.cells.setdefault(self.cell(item.pos), []).append(item)
+
+    def rebuild(self, items):
+        self.cells = dict()
+        for item in items:
+            self.cells.setdefault(self.cell(item.pos), []).append(item)
+
+    def query(self, pos):
+        """ Returns the items in the 3x3 cells around pos. """
+
+        cx, cy = self.cell(pos)
+        if self.wrap:
+            xs = {(cx + d) % self.n for d in (-1, 0, 1)}
+            ys = {(cy + d) % self.n for d in (-1, 0, 1)}
+        else:
+            xs = range(max(0, cx - 1), min(self.n, cx + 2))
+            ys = range(max(0, cy - 1), min(self.n, cy + 2))
+
+        result = list()
+        for x in xs:
+            for y in ys:
+                try:
+                    result += self.cells[(x, y)]
+                except KeyError:
+                    continue
+        return result
+
+    def query_rect(self, low, high):
+        """ Returns the items in the cells overlapping the rectangle from low (x, y) to high (x, y). """
+
+        low = self.cell(low)
+        high = self.cell(high)
+        result = list()
+        for x in range(low[0], high[0] + 1):
+            for y in range(low[1], high[1] + 1):
+                try:
+                    result += self.cells[(x, y)]
+                except KeyError:
+                    continue
+        return result
+
+    def query_radius(self, pos, r):
+        """ Returns the items within r of pos (the grid isn't wrapped around). """
+
+        r_squared = r * r
+        result = list()
+        for item in self.query_rect((pos[0] - r, pos[1] - r), (pos[0] + r, pos[1] + r)):
+            d_x = item.pos[0] - pos[0]
+            d_y = item.pos[1] - pos[1]
+            if (d_x * d_x) + (d_y * d_y) <= r_squared:
+                result.append(item)
+        return result
+
+    def nearest(self, pos, r, distance=None, reach=0):
+        """ Returns the item closest to pos within r, or None (the first one found on ties).
+            distance(item) is how far an item is from pos (between centres by default), it's at most
+            reach less than the distance between centres (e.g. to the edge of items no larger than reach).
+        """
+
+        closest = (None, None)
+        for item in self.query_radius(pos, r + reach):
+            if distance is None:
+                d_x = item.pos[0] - pos[0]
+                d_y = item.pos[1] - pos[1]
+                d = ((d_x * d_x) + (d_y * d_y)) ** 0.5
+            else:
+                d = distance(item)
+            if d <= r and (closest[1] is None or closest[1] > d):
+                closest = (item, d)
+        return closest[0]
+
+
+# Grids of NumPy kernels (see grid_blocks)
+GRID_MAX_CELLS = 32         # Max. cells along an axis
+GRID_TARGETS_PER_CELL = 32  # Min. targets per cell on average (few cells with many targets beat many with few)
+
+def grid_blocks(t_pos, s_pos, cell_size, period=None):
+    """ Groups targets (n x 2 positions) by the cell of a uniform grid they fall in & yields every group's
+        (target indices, source indices), the sources being the ones in the 3x3 cells around the group's.
+        Cells are at least cell_size wide, so any source within cell_size of a target is among them.
+        If period is set, the world wraps around (from -period / 2 to period / 2).
+    """
+
+    n = len(t_pos)
+    if n == 0 or len(s_pos) == 0:
+        return
+
+    if period is None:
+        low = np.minimum(t_pos.min(axis=0), s_pos.min(axis=0))
+        extent = max((np.maximum(t_pos.max(axis=0), s_pos.max(axis=0)) - low).max(), 1e-9)
+        t_rel = t_pos - low
+        s_rel = s_pos - low
+    else:
+        extent = period
+        t_rel = np.mod(t_pos + (period / 2.0), period)
+        s_rel = np.mod(s_pos + (period / 2.0), period)
+
+    n_cells = min(int(extent / max(cell_size, 1e-9)), GRID_MAX_CELLS, int(np.sqrt(n / GRID_TARGETS_PER_CELL)))
+    if n_cells < 1 or (period is not None and n_cells < 3):
+        n_cells = 1 # (Wrapped neighbouring cells would overlap)
+    size = extent / n_cells
+    t_cell = np.minimum((t_rel / size).astype(np.intp), n_cells - 1)
+    s_cell = np.minimum((s_rel / size).astype(np.intp), n_cells - 1)
+
+    # Sources sorted by cell, so every cell is a range
+    s_key = (s_cell[:, 0] * n_cells) + s_cell[:, 1]
+    s_order = np.argsort(s_key, kind='stable')
+    s_key = s_key[s_order]
+    cell_start = np.searchsorted(s_key, np.arange(n_cells * n_cells), side='left')
+    cell_end = np.searchsorted(s_key, np.arange(n_cells * n_cells), side='right')
+
+    t_key = (t_cell[:, 0] * n_cells) + t_cell[:, 1]
+    t_order = np.argsort(t_key, kind='stable')
+    for group in np.split(t_order, np.flatnonzero(np.diff(t_key[t_order])) + 1):
+
+        cx, cy = t_cell[group[0]]
+        if period is None:
+            cells = [(x * n_cells) + y for x in range(max(cx - 1, 0), min(cx + 2, n_cells))
+                                       for y in range(max(cy - 1, 0), min(cy + 2, n_cells))]
+        else:
+            cells = sorted({(((cx + d_x) % n_cells) * n_cells) + ((cy + d_y) % n_cells)
+                            for d_x in (-1, 0, 1) for d_y in (-1, 0, 1)})
+        sources = np.concatenate([s_order[cell_start[c]:cell_end[c]] for c in cells])
+        if len(sources) > 0:
+            yield group, sources
+
+
+"""
+    Verlet neighbour list: for every target, the sources within its radius plus a skin.
+    Positions change little per tick, so the list holds for many ticks: a source can only
+    get within the radius of a target after one of them moved more than half the skin.
+    Until then, kernels only need to check the listed pairs. The list is rebuilt (from a grid)
+    once anything moved that far, or when the amount of targets or sources or the radii changed.
+    Targets & sources are only known by their index: whichever they are, the listed pairs hold
+    as long as the positions at every index stay close to the ones the list was built from.
+    If period is set, the world wraps around & distances are minimum image distances.
+"""
+class VerletList:
+
+    BLOCK_SIZE = 1 << 20 # Max. amount of pairs checked at once when building
+
+    def __init__(self, skin, period=None):
+
+        if skin < 0:
+            raise Exception("Can't make VerletList with skin {}.".format(skin))
+
+        self.skin = skin
+        self.period = period
+
+        # Listed pairs
+        self.t_ix = np.zeros(0, dtype=np.int32)
+        self.s_ix = np.zeros(0, dtype=np.int32)
+
+        # State when built
+        self._t_radius = None
+        self._t_pos = None
+        self._s_pos = None
+
+        # Stats
+        self.updates = 0
+        self.builds = 0
+
+    def delta(self, d):
+        """ Returns the (minimum image, if wrapping) differences d of positions. """
+        if self.period is None:
+            return d
+        return d - (self.period * np.round(d / self.period))
+
+    def pairs(self, t_pos, t_radius, s_pos):
+        """ Returns the listed pairs (target indices, source indices), which include every source within the radius
+            of a target. Rebuilds the list if needed.
+        """
+
+        self.updates += 1
+        if self.is_stale(t_pos, t_radius, s_pos):
+            self.build(t_pos, t_radius, s_pos)
+        return self.t_ix, self.s_ix
+
+    def is_stale(self, t_pos, t_radius, s_pos):
+
+        if self._t_pos is None or len(t_pos) != len(self._t_pos) or len(s_pos) != len(self._s_pos):
+            return True
+        if not np.array_equal(t_radius, self._t_radius):
+            return True
+
+        max_sq = (self.skin / 2.0) * (self.skin / 2.0)
+        for pos, ref in ((t_pos, self._t_pos), (s_pos, self._s_pos)):
+            d = self.delta(pos - ref)
+            if ((d[:, 0] * d[:, 0]) + (d[:, 1] * d[:, 1]) > max_sq).any():
+                return True
+        return False
+
+    def build(self, t_pos, t_radius, s_pos):
+
+        self.builds += 1
+        reach = np.abs(t_radius) + self.skin
+        t_parts = list()
+        s_parts = list()
+        for group, sources in grid_blocks(t_pos, s_pos, reach.max(), self.period):
+            s_x = s_pos[sources, 0]
+            s_y = s_pos[sources, 1]
+            block = max(1, self.BLOCK_SIZE // len(sources))
+            for start in range(0, len(group), block):
+                targets = group[start:start + block]
+                d_x = self.delta(s_x[None, :] - t_pos[targets, 0][:, None])
+                d_y = self.delta(s_y[None, :] - t_pos[targets, 1][:, None])
+                rows, cols = np.nonzero(((d_x * d_x) + (d_y * d_y)) <= np.square(reach[targets])[:, None])
+                t_parts.append(targets[rows])
+                s_parts.append(sources[cols])
+
+        if len(t_parts) > 0:
+            self.t_ix = np.concatenate(t_parts).astype(np.int32)
+            self.s_ix = np.concatenate(s_parts).astype(np.int32)
+        else:
+            self.t_ix = np.zeros(0, dtype=np.int32)
+            self.s_ix = np.zeros(0, dtype=np.int32)
+        self._t_radius = t_radius.copy()
+        self._t_pos = t_pos.copy()
+        self._s_pos = s_pos.copy()
+
+    def stats(self):
+        rate = (self.builds / self.updates) if self.updates > 0 else None
+        return {"skin": self.skin, "ticks": self.updates, "rebuilds": self.builds, "rebuild_rate": rate,
+                "pairs": len(self.t_ix)}
+
+
+"""
+    Ordered collection of entities with stable handles.
+    Every added entity gets a handle (slot, generation), which keeps referring to it
+    (& only to it) until it's removed. Freed slots are reused with a new generation, so
+    stale handles resolve to None.
+    Removing is O(1): removed entities are only dropped from the (ordered) list when
+    compacting, which takes one pass however many were removed.
+"""
+class EntityStore:
+
+    def __init__(self):
+
+        self.entities = list()      # Dense, in order of adding
+        self._slots = list()        # Slot -> entity (None if free)
+        self._generations = list()  # Slot -> generation
+        self._free = list()
+        self._removed = 0           # Removed, but not yet compacted
+
+    def add(self, e):
+        """ Appends e & returns its handle. """
+
+        if len(self._free) > 0:
+            slot = self._free.pop()
+            self._generations[slot] += 1
+        else:
+            slot = len(self._slots)
+            self._slots.append(None)
+            self._generations.append(0)
+
+        self._slots[slot] = e
+        e.handle = (slot, self._generations[slot])
+        self.entities.append(e)
+        return e.handle
+
+    def get(self, handle):
+        """ Returns the entity of handle, or None if it was removed. """
+
+        if handle is None:
+            return None
+        slot, generation = handle
+        if slot < len(self._slots) and self._generations[slot] == generation:
+            return self._slots[slot]
+        return None
+
+    def contains(self, e):
+        return e.handle is not None and self.get(e.handle) is e
+
+    def remove(self, e):
+        """ Frees e's handle. e stays in the list until the next compact. """
+
+        if not self.contains(e):
+            raise Exception("Removing entity that isn't stored.")
+        slot = e.handle[0]
+        self._slots[slot] = None
+        self._free.append(slot)
+        e.handle = None
+        self._removed += 1
+
+    def compact(self):
+        """ Drops removed entities from the list, keeping the others in order. """
+
+        if self._removed > 0:
+            self.entities = [e for e in self.entities if e.handle is not None]
+            self._removed = 0
+
+    def clear(self):
+        for e in self.entities:
+            e.handle = None
+        self.__init__()
+
+    def __len__(self):
+        return len(self.entities)
+
+
+"""
+    Trails (rings of previous positions) of many particles in one array.
+    Every trail owns a slot: a ring of up to `limit` points in an N x L x 2 array.
+    Pushing & dropping points is done for a whole set of slots at once.
+    L grows when a trail needs a larger limit; N grows when more slots are needed.
+"""
+class TrailBuffer:
+
+    def __init__(self, capacity=64, length=150):
+
+        self.data = np.zeros((capacity, length, 2))
+        self.start = np.zeros(capacity, dtype=np.intp) # Ring index of the oldest point
+        self.count = np.zeros(capacity, dtype=np.intp)
+        self.limit = np.full(capacity, length, dtype=np.intp)
+        self._free = list(range(capacity - 1, -1, -1))
+
+    def attach(self, items=None, limit=None):
+        """ Returns a view on a new trail, filled with items (optional, oldest first). """
+
+        if len(self._free) == 0:
+            self._grow(2 * len(self.data), self.data.shape[1])
+        slot = self._free.pop()
+        self.start[slot] = 0
+        self.count[slot] = 0
+        self.limit[slot] = self.data.shape[1]
+        view = TrailView(self, slot)
+        if limit is not None:
+            view.set_limit(limit)
+        if items is not None and len(items) > 0:
+            view.fill(items)
+        return view
+
+    def release(self, view):
+        self.count[view.slot] = 0
+        self._free.append(view.slot)
+        view.buffer = None
+
+    def push(self, slots, positions):
+        """ Appends a position to each of the slots, dropping their oldest point if full. """
+
+        if len(slots) == 0:
+            return
+        limit = self.limit[slots]
+        full = self.count[slots] >= limit
+        ix = np.where(full, self.start[slots], (self.start[slots] + self.count[slots]) % limit)
+        self.data[slots, ix] = positions
+        self.start[slots] = np.where(full, (self.start[slots] + 1) % limit, self.start[slots])
+        self.count[slots] = np.minimum(self.count[slots] + 1, limit)
+
+    def pop(self, slots):
+        """ Drops the oldest point of each of the (non-empty) slots. """
+
+        slots = slots[self.count[slots] > 0]
+        self.start[slots] = (self.start[slots] + 1) % self.limit[slots]
+        self.count[slots] -= 1
+
+    def points(self, slots):
+        """ Returns the points of the slots as one (n x 2) array, per slot oldest first. """
+
+        slots = np.asarray(slots, dtype=np.intp)
+        age = np.arange(self.data.shape[1])
+        ix = (self.start[slots, None] + age[None, :]) % self.limit[slots, None]
+        present = age[None, :] < self.count[slots, None]
+        return self.data[slots[:, None], ix][present]
+
+    def _grow(self, capacity, length):
+        """ Reallocates the array. Rings are stored from index 0 again. """
+
+        old = len(self.data)
+        data = np.zeros((capacity, length, 2))
+        used = np.flatnonzero(self.count[:old] > 0)
+        age = np.arange(self.data.shape[1])
+        ix = (self.start[used, None] + age[None, :]) % self.limit[used, None]
+        data[used, :self.data.shape[1]] = self.data[used[:, None], ix]
+        self.data = data
+        self.start = np.zeros(capacity, dtype=np.intp)
+        self.count = np.concatenate((self.count, np.zeros(capacity - old, dtype=np.intp)))
+        self.limit = np.concatenate((self.limit, np.full(capacity - old, length, dtype=np.intp)))
+        self._free = list(range(capacity - 1, old - 1, -1)) + self._free
+
+
+"""
+    One trail in a TrailBuffer, with (most of) the interface of a LimitedList.
+"""
+class TrailView:
+
+    def __init__(self, buffer, slot):
+        self.buffer = buffer
+        self.slot = slot
+
+    @property
+    def limit(self):
+        return int(self.buffer.limit[self.slot])
+
+    def length(self):
+        return int(self.buffer.count[self.slot])
+
+    def push(self, el):
+        self.buffer.push(np.array([self.slot]), np.array([el], dtype=float))
+
+    def pop(self, ix=None):
+        if ix not in (None, 0):
+            raise KeyError("Trails can only drop their oldest point.")
+        if self.length() == 0:
+            raise KeyError("Popping item 0 in list of length 0")
+        self.buffer.pop(np.array([self.slot]))
+
+    def clear(self):
+        self.buffer.count[self.slot] = 0
+
+    def fill(self, items):
+        """ Replaces the points by items (oldest first), keeping the newest that fit. """
+        items = np.asarray(items, dtype=float).reshape(-1, 2)[-self.limit:]
+        self.buffer.data[self.slot, :len(items)] = items
+        self.buffer.start[self.slot] = 0
+        self.buffer.count[self.slot] = len(items)
+
+    def set_limit(self, l):
+        """ Changes the limit. If reduced, pops elements that don't fit. """
+        if l <= 0:
+            raise Exception("Can't set trail limit to 0.")
+
+        items = self.array()
+        if l > self.buffer.data.shape[1]:
+            self.buffer._grow(len(self.buffer.data), l)
+        self.buffer.limit[self.slot] = l
+        self.fill(items)
+
+    def array(self):
+        return self.buffer.points([self.slot])
+
+    def segments(self):
+        return [self.array()]
+
+    def __getitem__(self, ix):
+        items = self.array()
         try:
-            self._list[ix] = item
-        except Exception as e:
-            raise e
\ No newline at end of file
+            return tuple(items[ix].tolist())
+        except IndexError:
+            raise KeyError("Requested index {} in list of length {}.".format(ix, len(items)))
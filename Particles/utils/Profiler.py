@@ -38,3 +38,78 @@ def get_numeric_category_avg(category):
     except ZeroDivisionError:
         Logger.log_warning("Empty profiler category '{}'. Cannot compute average.".format(category))
     return None
+
+
+# Memory
+
+def measure_memory(factory, n):
+    """ Returns the bytes allocated per object when creating n objects with factory (tracemalloc). """
+
+    import gc, tracemalloc
+    gc.collect()
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    objects = [factory() for _ in range(n)]
+    allocated = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    del objects
+    # The list holding the objects doesn't count
+    return (allocated - (n * 8)) / n
+
+
+
+# Startup time
+
+IMPORT_BUDGET = 0.25 # Seconds the headless import path may take
+
+
+def measure_import_time(module, python=None):
+    """ Imports module in a fresh interpreter (python -X importtime).
+        Returns a list of (module, self time, cumulative time) in seconds, in import order.
+    """
+
+    import subprocess, sys
+    if python is None:
+        python = sys.executable
+    proc = subprocess.run([python, "-X", "importtime", "-c", "import {}".format(module)],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if proc.returncode != 0:
+        Logger.log_warning("Could not import '{}': {}".format(module, proc.stderr.strip().splitlines()[-1:]))
+        return None
+
+    times = list()
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        try:
+            times.append((fields[2].strip(), int(fields[0]) / 1e6, int(fields[1]) / 1e6))
+        except ValueError:
+            pass # Header
+    return times
+
+
+def startup_report(module="Particles.headless", budget=IMPORT_BUDGET, top=10):
+    """ Logs the import time of module, with its slowest imports. Returns True if it stays within budget. """
+
+    times = measure_import_time(module)
+    if times is None:
+        return False
+    total = sum(t[1] for t in times)
+    imported = set(t[0] for t in times)
+
+    Logger.log("<----------------->")
+    Logger.log("> Startup time ({})".format(module))
+    Logger.log(">> Total import time: {:.1f} ms ({} modules, budget {:.1f} ms)".format(total * 1000, len(times), budget * 1000))
+    for name, t_self, t_cumulative in sorted(times, key=lambda t: t[1], reverse=True)[:top]:
+        Logger.log(">> {}: {:.2f} ms (cumulative {:.2f} ms)".format(name, t_self * 1000, t_cumulative * 1000))
+    Logger.log("<----------------->")
+
+    within_budget = total <= budget
+    if within_budget:
+        Logger.log_system("Importing '{}' takes {:.1f} ms (budget {:.1f} ms).".format(module, total * 1000, budget * 1000))
+    else:
+        Logger.log_warning("Importing '{}' takes {:.1f} ms, over the budget of {:.1f} ms.".format(module, total * 1000, budget * 1000))
+    if "pyglet" in imported:
+        Logger.log_warning("Importing '{}' loads pyglet.".format(module))
+    return within_budget
@@ -0,0 +1,274 @@
+"""
+    Persistent rendering of particles.
+    Particles are drawn as circles from pools: one indexed vertex list per tessellation
+    (amount of circle points), kept in a batch that lives as long as the simulation.
+    A particle owns a slot of a pool from the first frame it's drawn until it's released.
+    Every frame, only the positions & colours of the slots are written, by slice assignment
+    of a unit circle template: no geometry is rebuilt or added to the batch again.
+    All geometry is in world coordinates (see Transform.set_world_view), so it stays valid
+    when the window is resized.
+    The tessellation of a particle follows its radius on screen (level of detail): small
+    particles are drawn with a handful of points, zooming in on them brings back the detail.
+"""
+import bisect, math, time
+import numpy as np
+import pyglet
+from Particles.utils import Shapes, Transform
+
+
+# Tessellations to pick from (amounts of circle points), coarse to fine
+LOD_LEVELS = (4, 6, 8, 12, 16, 24, 32, 48, 64, 100)
+LOD_MAX_ERROR = 0.5 # Max. distance (pixels) between a circle & its polygon
+
+# Force lines (debug view)
+LINE_WIDTH_MOD = 7500          # Line width (pixels) per unit of force
+LINE_WIDTHS = (1, 2, 4, 8)     # Widths lines are rounded to, one draw call each
+LABEL_RATE = 4.0               # Max. text updates per second of a force label
+LABEL_THRESHOLD = 0.05         # Relative change of a force before its label is updated
+
+
+def lod_points(pixel_radius, max_points, max_error=LOD_MAX_ERROR):
+    """ Returns the fewest circle points (of LOD_LEVELS, up to max_points) drawing a circle of pixel_radius
+        within max_error pixels.
+    """
+    for n_points in LOD_LEVELS:
+        if n_points >= max_points:
+            break
+        if pixel_radius * (1.0 - math.cos(math.pi / n_points)) <= max_error:
+            return n_points
+    return max_points
+
+
+class ScreenGroup(pyglet.graphics.Group):
+    """ Draws its contents in window coordinates, whatever the current view (for text). """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+    def set_state(self):
+        pyglet.gl.glMatrixMode(pyglet.gl.GL_MODELVIEW)
+        pyglet.gl.glPushMatrix()
+        pyglet.gl.glLoadIdentity()
+
+    def unset_state(self):
+        pyglet.gl.glMatrixMode(pyglet.gl.GL_MODELVIEW)
+        pyglet.gl.glPopMatrix()
+
+SCREEN_GROUP = ScreenGroup()
+
+
+class CirclePool:
+    """ Slots for circles of n_points sides, in one vertex list. Free slots are collapsed to a point. """
+
+    def __init__(self, batch, n_points, capacity=64):
+
+        self.batch = batch
+        self.n_points = n_points
+        self.n_verts = n_points + 2 # Centre, outline & closing vertex, like Shapes.make_circle
+
+        self.vlist = None
+        self.capacity = 0
+        self.free = list()   # Free slots, lowest last
+        self.owners = list() # Slot -> entity (None if free)
+        self.shown = np.zeros(0, dtype=bool) # Slots drawn last frame
+
+        offsets, self.indices = Shapes.circle_geometry(n_points)
+        self.template = offsets.astype(np.float32)
+
+        self._grow(capacity)
+
+    def _vertices(self):
+        return np.frombuffer(self.vlist.vertices, dtype=np.float32).reshape(self.capacity, self.n_verts, 2)
+
+    def _colors(self):
+        return np.frombuffer(self.vlist.colors, dtype=np.uint8).reshape(self.capacity, self.n_verts, 3)
+
+    def _grow(self, capacity):
+        """ Replaces the vertex list by one with room for capacity circles, keeping the data of the slots. """
+
+        indices = (np.asarray(self.indices)[None, :] + (np.arange(capacity) * self.n_verts)[:, None]).ravel()
+
+        # (VertexList.resize doesn't move indices along, so the list is replaced instead)
+        old = self.vlist
+        old_capacity = self.capacity
+        self.vlist = self.batch.add_indexed(capacity * self.n_verts, pyglet.gl.GL_TRIANGLES, None, indices.tolist(),
+                                            'v2f/stream', 'c3B/stream')
+        self.capacity = capacity
+        verts = self._vertices()
+        colors = self._colors()
+        verts[old_capacity:] = 0.0
+        colors[old_capacity:] = 0
+        if old is not None:
+            verts[:old_capacity] = np.frombuffer(old.vertices, dtype=np.float32).reshape(old_capacity, self.n_verts, 2)
+            colors[:old_capacity] = np.frombuffer(old.colors, dtype=np.uint8).reshape(old_capacity, self.n_verts, 3)
+            old.delete()
+
+        self.free += list(range(capacity - 1, old_capacity - 1, -1))
+        self.owners += [None] * (capacity - old_capacity)
+        self.shown = np.concatenate([self.shown, np.zeros(capacity - old_capacity, dtype=bool)])
+
+    def allocate(self, owner):
+        """ Returns a free slot for owner. """
+        if len(self.free) == 0:
+            self._grow(2 * self.capacity)
+        slot = self.free.pop()
+        self.owners[slot] = owner
+        return slot
+
+    def release(self, slot):
+        """ Frees a slot & hides its circle. """
+        self.owners[slot] = None
+        self.free.append(slot)
+        self.shown[slot] = False
+        self._vertices()[slot] = 0.0
+
+    def show(self, slots, centres, radii, colors):
+        """ Draws (only) the circles of slots from now on, given their centres (n x 2), radii (n) and colours (n x 3).
+            Slots shown before but not now (e.g. out of view) are hidden.
+        """
+        verts = self._vertices()
+        shown = np.zeros(self.capacity, dtype=bool)
+        shown[slots] = True
+        hidden = self.shown & ~shown
+        if hidden.any():
+            verts[hidden] = 0.0
+        self.shown = shown
+
+        if len(slots) > 0:
+            verts[slots] = centres[:, None, :] + radii[:, None, None] * self.template
+            self._colors()[slots] = colors[:, None, :]
+
+    def __len__(self):
+        return self.capacity - len(self.free)
+
+
+class ParticleRenderer:
+    """ Draws particles from circle pools. Particles provide pos, size, determine_color() & CIRCLE_POINTS
+        (their tessellation at full detail).
+    """
+
+    def __init__(self):
+
+        self.batch = pyglet.graphics.Batch()
+        self.pools = dict() # Amount of circle points -> CirclePool
+        self.slots = dict() # Particle -> (pool, slot)
+        self.max_error = LOD_MAX_ERROR
+
+    def _allocate(self, p, n_points):
+        pool = self.pools.get(n_points)
+        if pool is None:
+            pool = CirclePool(self.batch, n_points)
+            self.pools[n_points] = pool
+        entry = (pool, pool.allocate(p))
+        self.slots[p] = entry
+        return entry
+
+    def release(self, p):
+        """ Frees the slot of a particle that is no longer drawn. """
+        entry = self.slots.pop(p, None)
+        if entry is not None:
+            entry[0].release(entry[1])
+
+    def clear(self):
+        for p in list(self.slots.keys()):
+            self.release(p)
+
+    def update(self, particles):
+        """ Draws particles (& no others) from now on: writes their current positions, sizes & colours
+            to their slots, allocating new ones.
+        """
+
+        # Radius on screen (pixels) per world unit of particle size
+        pixel_scale = Shapes.RADIUS_SCALE * Transform.CAM_ZOOM * min(Transform.WIN_WIDTH, Transform.WIN_HEIGHT) / 2.0
+        lod = dict() # (size, max. points) -> points, most particles share their size
+
+        # Group per pool
+        groups = dict()
+        for p in particles:
+            key = (p.size, p.CIRCLE_POINTS)
+            n_points = lod.get(key)
+            if n_points is None:
+                n_points = lod[key] = lod_points(p.size * pixel_scale, p.CIRCLE_POINTS, self.max_error)
+            entry = self.slots.get(p)
+            if entry is None or entry[0].n_points != n_points:
+                self.release(p)
+                entry = self._allocate(p, n_points)
+            group = groups.get(entry[0])
+            if group is None:
+                group = groups[entry[0]] = ([], [], [], [])
+            group[0].append(entry[1])
+            group[1].append(p.pos)
+            group[2].append(p.size)
+            group[3].append(p.determine_color())
+
+        # Write every pool at once (pools without particles in view are emptied)
+        for pool in self.pools.values():
+            if pool not in groups:
+                pool.show([], None, None, None)
+        for pool, (slots, pos, size, colors) in groups.items():
+            centres = np.array(pos, dtype=np.float32)
+            radii = np.array(size, dtype=np.float32) * Shapes.RADIUS_SCALE
+            pool.show(np.array(slots), centres, radii, np.array(colors).astype(np.uint8))
+
+    def draw(self):
+        self.batch.draw()
+
+
+class ForceLines:
+    """ Draws the force lines of particles in debug view (see ForceParticle.force_lines).
+        Lines are drawn in one call per width in LINE_WIDTHS. Labels are kept between frames & follow
+        their lines, their text is only updated (at most LABEL_RATE times per second) when their force changed.
+    """
+
+    def __init__(self):
+
+        self.batch = pyglet.graphics.Batch()
+        self.labels = dict() # (particle, source) -> [label, force shown, time of update]
+        self._bounds = [(a + b) / 2.0 for a, b in zip(LINE_WIDTHS[:-1], LINE_WIDTHS[1:])]
+
+    def draw(self, particles):
+
+        now = time.perf_counter()
+        lines = [list() for _ in LINE_WIDTHS]
+        labels = dict()
+        for p in particles:
+            for e, f in p.force_lines:
+                F = math.sqrt((f[0]*f[0]) + (f[1]*f[1]))
+                if F == 0:
+                    continue
+                lines[bisect.bisect(self._bounds, F * LINE_WIDTH_MOD)] += [p.pos[0], p.pos[1], e.pos[0], e.pos[1]]
+
+                key = (p, e)
+                entry = self.labels.pop(key, None)
+                label_pos = ((e.pos[0] + p.pos[0]) / 2.0, (e.pos[1] + p.pos[1]) / 2.0)
+                if entry is None:
+                    entry = [Shapes.make_label(self.label_text(f), label_pos, size=10, batch=self.batch), F, now]
+                else:
+                    # Labels follow their line every frame (if it moved), only their text is throttled
+                    x, y = Transform.world_to_screen(label_pos)
+                    if entry[0].x != x or entry[0].y != y:
+                        entry[0].x, entry[0].y = x, y
+                    if now - entry[2] >= 1.0 / LABEL_RATE and abs(F - entry[1]) > LABEL_THRESHOLD * entry[1]:
+                        entry[0].text = self.label_text(f)
+                        entry[1] = F
+                        entry[2] = now
+                labels[key] = entry
+
+        # Labels of lines that are gone
+        for entry in self.labels.values():
+            entry[0].delete()
+        self.labels = labels
+
+        for width, verts in zip(LINE_WIDTHS, lines):
+            if len(verts) > 0:
+                pyglet.gl.glLineWidth(width)
+                pyglet.graphics.draw(len(verts) // 2, pyglet.gl.GL_LINES, ('v2f', verts))
+        pyglet.gl.glLineWidth(1)
+        self.batch.draw()
+
+    @staticmethod
+    def label_text(f):
+        return "{:.2e} / {:.2e}".format(f[0], f[1])
+
+
+FORCE_LINES = ForceLines()
@@ -2,29 +2,38 @@
     Utility methods related to creating shapes in pyglet.
     Since the GL primitives require points, these methods provide 
     the right data to pass to pyglet.graphics.draw()
+    Shapes are in world coordinates: they're mapped to the window by the GL modelview matrix
+    (see Transform.set_world_view). Labels are the exception, they're placed in pixels.
 """
-import math
+import math, time
+import numpy as np
 import pyglet
 from Particles.utils import Transform
 
-def make_label(text, pos = (0, 0), size=16, anchor_x='center', anchor_y='center', batch=None):
+# Circles are drawn radius * the window size wide (i.e. 2 * radius in world units)
+RADIUS_SCALE = 2.0
 
-    screenpos = Transform.world_to_screen(pos)
+
+
+def make_label(text, pos = (0, 0), size=16, anchor_x='center', anchor_y='center', batch=None, group=None, camera=True):
+    """ Returns a label at the world position pos. Labels are drawn in pixels: group should be (a child of) a Renderer.ScreenGroup. """
+    from Particles.utils.Renderer import SCREEN_GROUP
+
+    screenpos = Transform.world_to_screen(pos, camera)
     label = pyglet.text.Label(text, font_name='Arial', font_size=size,
                                             x=screenpos[0], y=screenpos[1],
-                                            anchor_x=anchor_x, anchor_y=anchor_y, batch=batch)
+                                            anchor_x=anchor_x, anchor_y=anchor_y, batch=batch,
+                                            group=SCREEN_GROUP if group is None else group)
     return label
 
 def make_point(pos, color = (255, 255, 255)):
-    pos = Transform.world_to_screen(pos)
     point = pyglet.graphics.vertex_list(1, ('v2f', [pos[0], pos[1]]), ('c3B', [color[0], color[1], color[2]]))
     return point
 
 def make_points(points, color = (255, 255, 255), as_vertexlist = False):
     verts = list()
     colors = list()
-    for p in points:
-        pos = Transform.world_to_screen(p)
+    for pos in points:
         verts += [pos[0], pos[1]]
         colors += [color[0], color[1], color[2]]
     points = (('v2f', verts), ('c3B', colors))
@@ -32,38 +41,74 @@ def make_points(points, color = (255, 255, 255), as_vertexlist = False):
         points = pyglet.graphics.vertex_list(len(points), ('v2f', verts), ('c3B', colors))
     return points
 
+def make_points_from_arrays(segments, color = (255, 255, 255)):
+    """ Returns a vertex list of points, filled straight from arrays of world positions (n x 2),
+        such as LimitedList.segments(). Delete it after drawing.
+    """
+    n = sum(len(s) for s in segments)
+    points = pyglet.graphics.vertex_list(n, 'v2f/stream', 'c3B/static')
+    verts = np.frombuffer(points.vertices, dtype=np.float32).reshape(n, 2)
+    offset = 0
+    for s in segments:
+        verts[offset:offset + len(s)] = s
+        offset += len(s)
+    np.frombuffer(points.colors, dtype=np.uint8).reshape(n, 3)[:] = color
+    return points
+
+# Unit circles per amount of points, see circle_geometry
+_CIRCLES = dict()
+
+def circle_geometry(n_points = 100):
+    """ Returns the (cached) geometry of a circle with n_points sides & radius 1:
+        the offsets of its vertices from the centre ((n_points + 2) x 2, starting with the
+        centre & ending with the closing vertex) and the indices of its triangles.
+    """
+    if n_points not in _CIRCLES:
+        angles = np.radians(np.arange(n_points) / n_points * 360.0)
+        offsets = np.zeros((n_points + 2, 2))
+        offsets[1:-1, 0] = np.cos(angles)
+        offsets[1:-1, 1] = np.sin(angles)
+        offsets[-1] = (1.0, 0.0)
+        offsets.flags.writeable = False
+
+        sides = np.arange(1, n_points + 1)
+        indices = tuple(np.stack([np.zeros_like(sides), sides, sides + 1], axis=1).ravel().tolist())
+        _CIRCLES[n_points] = (offsets, indices)
+    return _CIRCLES[n_points]
+
 def make_circle(n_points = 100, center = (0, 0), radius = 1, color = (255, 255, 255), as_vertexlist = False):
-    c = Transform.world_to_screen(center)
-    r = (Transform.WIN_WIDTH * radius, Transform.WIN_HEIGHT * radius)
-    # Add degenerated vertex in front
-    verts = [c[0], c[1]]
-    colors = [color[0], color[1], color[2]]
-    # Make main circle
-    for i in range(n_points):
-        angle = math.radians(float(i)/n_points * 360.0)
-        x = r[0]*math.cos(angle) + c[0]
-        y = r[1]*math.sin(angle) + c[1]
-        verts += [x,y]
-        colors += [color[0], color[1], color[2]]
-    # Add final degenerated vertex
-    verts += [r[0]*math.cos(0) + c[0], r[1]*math.sin(0) + c[1]]
-    colors += [color[0], color[1], color[2]]
-
-    # Create indices
-    indices = list()
-    for side in range(1, n_points+1):
-        indices.append(0)
-        indices.append(side)
-        indices.append(side+1)
-    
+    offsets, indices = circle_geometry(n_points)
+
+    # Degenerated vertex in front, main circle & final degenerated vertex
+    verts = (offsets * (RADIUS_SCALE * radius) + center).ravel().tolist()
+    colors = [color[0], color[1], color[2]] * (n_points + 2)
+
     circle = (indices, ('v2f', verts), ('c3B', colors))
     if as_vertexlist:
         circle = pyglet.graphics.vertex_list(int(len(verts) / 2), ('v2f', verts), ('c3B', colors))
     return circle
 
+def make_circles(centers, radii, colors = (255, 255, 255), n_points = 100):
+    """ make_circle for many circles at once, from arrays of world centres (n x 2), radii (n)
+        and colours (n x 3, or one colour for all).
+        Returns the indices, vertices & colours of all circles as one flat array each,
+        ready for batch.add_indexed(len(verts) // 2, GL_TRIANGLES, None, indices, ('v2f', verts), ('c3B', colors)).
+    """
+    offsets, indices = circle_geometry(n_points)
+    centers = np.asarray(centers, dtype=float).reshape(-1, 2)
+    radii = np.asarray(radii, dtype=float).reshape(-1, 1, 1) * RADIUS_SCALE
+    n = len(centers)
+    n_verts = n_points + 2
+
+    verts = np.empty((n, n_verts, 2), dtype=np.float32)
+    np.multiply(radii, offsets, out=verts, casting="same_kind")
+    verts += centers[:, None, :]
+    circle_colors = np.empty((n, n_verts, 3), dtype=np.uint8)
+    circle_colors[...] = np.asarray(colors, dtype=np.uint8).reshape(-1, 1, 3)
+    indices = (np.asarray(indices)[None, :] + (np.arange(n) * n_verts)[:, None]).ravel()
+    return indices, verts.ravel(), circle_colors.ravel()
+
 def make_line(a, b, n_points = 2, thickness = 1, color = (255, 255, 255)):
-    a = Transform.world_to_screen(a)
-    b = Transform.world_to_screen(b)
     thickness = max(thickness, 0.1)
     verts = [a[0], a[1], b[0], b[1]]
     colors = list()
@@ -75,22 +120,14 @@ def make_line(a, b, n_points = 2, thickness = 1, color = (255, 255, 255)):
 
 def make_rect(top_left, w, h, color=(255, 255, 255), as_vertexlist = False):
 
-    #top_left = Transform.world_to_screen(top_left)
-    #size = Transform.world_to_screen((w, h))
-    #w = size[0]
-    #h = size[1]
     verts = list()
     colors = list()
 
     # Add corners to rectangle
-    P_top_left = Transform.world_to_screen(top_left)
-    verts += [P_top_left[0], P_top_left[1]]
-    P_top_right = Transform.world_to_screen((top_left[0]+ w, top_left[1]))
-    verts += [P_top_right[0], P_top_right[1]]
-    P_bot_right = Transform.world_to_screen((top_left[0] + w, top_left[1] - h))
-    verts += [P_bot_right[0], P_bot_right[1]]
-    P_bot_left = Transform.world_to_screen((top_left[0], top_left[1] - h))
-    verts += [P_bot_left[0], P_bot_left[1]]
+    verts += [top_left[0], top_left[1]]
+    verts += [top_left[0] + w, top_left[1]]
+    verts += [top_left[0] + w, top_left[1] - h]
+    verts += [top_left[0], top_left[1] - h]
 
     for _ in range(4):
         colors += [color[0], color[1], color[2]]
@@ -98,4 +135,61 @@ def make_rect(top_left, w, h, color=(255, 255, 255), as_vertexlist = False):
     rect = (('v2f', verts), ('c3B', colors))
     if as_vertexlist:
         rect = pyglet.graphics.vertex_list(4, ('v2f', verts), ('c3B', colors))
-    return rect
\ No newline at end of file
+    return rect
+
+# Benchmark
+
+def circle_benchmark(n=1000, n_points=100, repeat=5):
+    """ Returns the avg. time (s) to build the geometry of n circles one call per circle without the geometry
+        cache (the per-call path make_circle had before it), with make_circle & with make_circles (one call),
+        CPU side only.
+    """
+
+    centers = np.random.uniform(-1, 1, (n, 2))
+    radii = np.random.uniform(0.002, 0.01, n)
+    colors = np.random.randint(0, 256, (n, 3))
+
+    def uncached():
+        # Trig & indices per call, as make_circle did before circle_geometry
+        for c, r, col in zip(centers.tolist(), radii.tolist(), colors.tolist()):
+            r *= RADIUS_SCALE
+            verts = [c[0], c[1]]
+            circle_colors = [col[0], col[1], col[2]]
+            for i in range(n_points):
+                angle = math.radians(float(i)/n_points * 360.0)
+                verts += [r*math.cos(angle) + c[0], r*math.sin(angle) + c[1]]
+                circle_colors += [col[0], col[1], col[2]]
+            verts += [r*math.cos(0) + c[0], r*math.sin(0) + c[1]]
+            circle_colors += [col[0], col[1], col[2]]
+            indices = list()
+            for side in range(1, n_points+1):
+                indices += [0, side, side+1]
+
+    def per_call():
+        for c, r, col in zip(centers.tolist(), radii.tolist(), colors.tolist()):
+            make_circle(n_points, c, r, col)
+
+    def batched():
+        make_circles(centers, radii, colors, n_points)
+
+    results = dict()
+    for name, f in (("uncached", uncached), ("make_circle", per_call), ("make_circles", batched)):
+        f() # Warm up (fills the geometry cache)
+        starttime = time.perf_counter()
+        for _ in range(repeat):
+            f()
+        results[name] = (time.perf_counter() - starttime) / repeat
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(prog="python -m Particles.utils.Shapes", description="Circle geometry benchmark.")
+    parser.add_argument("--circles", type=int, default=1000)
+    parser.add_argument("--points", type=int, default=100)
+    args = parser.parse_args()
+    results = circle_benchmark(args.circles, args.points)
+    for name, t in results.items():
+        print("{}: {:.2f} ms for {} circles".format(name, t * 1000, args.circles))
+    print("speedup of the cache: {:.1f}x".format(results["uncached"] / results["make_circle"]))
+    print("speedup of make_circles: {:.1f}x".format(results["make_circle"] / results["make_circles"]))
@@ -3,32 +3,81 @@ import math
 WIN_WIDTH = 300
 WIN_HEIGHT = 400
 
+# Camera: world position shown in the centre of the window & magnification
+CAM_CENTER = (0.0, 0.0)
+CAM_ZOOM = 1.0
+
 def set_win_size(w, h):
     global WIN_WIDTH 
     WIN_WIDTH= w
     global WIN_HEIGHT 
     WIN_HEIGHT = h
 
-def world_to_screen(pos):
+def set_camera(center=None, zoom=None):
+    global CAM_CENTER
+    global CAM_ZOOM
+    if center is not None:
+        CAM_CENTER = (center[0], center[1])
+    if zoom is not None:
+        CAM_ZOOM = zoom
+
+def get_view_bounds(margin=0):
+    """ Returns the lowest & highest world position in view ((x, y), (x, y)), widened by margin. """
+    extent = (1.0 / CAM_ZOOM) + margin
+    return ((CAM_CENTER[0] - extent, CAM_CENTER[1] - extent), (CAM_CENTER[0] + extent, CAM_CENTER[1] + extent))
+
+def _camera(camera):
+    """ Returns the camera centre & zoom to map with (the default view if camera is False, e.g. for UI). """
+    if camera:
+        return CAM_CENTER, CAM_ZOOM
+    return (0.0, 0.0), 1.0
+
+def world_to_screen(pos, camera=True):
     global WIN_WIDTH
     global WIN_HEIGHT
-    ratio_x = WIN_WIDTH / 2.0
-    ratio_y = WIN_HEIGHT / 2.0
-    x = (pos[0] * ratio_x) + ratio_x
-    y = (pos[1] * ratio_y) + ratio_y
+    center, zoom = _camera(camera)
+    ratio_x = zoom * WIN_WIDTH / 2.0
+    ratio_y = zoom * WIN_HEIGHT / 2.0
+    x = ((pos[0] - center[0]) * ratio_x) + (WIN_WIDTH / 2.0)
+    y = ((pos[1] - center[1]) * ratio_y) + (WIN_HEIGHT / 2.0)
     return (x, y)
 
-def screen_to_world(pos):
+def world_to_screen_array(points, camera=True):
+    """ world_to_screen for a NumPy array of positions (n x 2). """
+    center, zoom = _camera(camera)
+    ratio = (zoom * WIN_WIDTH / 2.0, zoom * WIN_HEIGHT / 2.0)
+    return ((points - center) * ratio) + (WIN_WIDTH / 2.0, WIN_HEIGHT / 2.0)
+
+def set_world_view(camera=True):
+    """ Sets the GL modelview matrix to the mapping of world_to_screen, so geometry can stay in world
+        coordinates (& valid across resizes). Call once per frame, before drawing the world.
+    """
+    from pyglet import gl
+    center, zoom = _camera(camera)
+    gl.glMatrixMode(gl.GL_MODELVIEW)
+    gl.glLoadIdentity()
+    gl.glTranslatef(WIN_WIDTH / 2.0, WIN_HEIGHT / 2.0, 0.0)
+    gl.glScalef(zoom * WIN_WIDTH / 2.0, zoom * WIN_HEIGHT / 2.0, 1.0)
+    gl.glTranslatef(-center[0], -center[1], 0.0)
+
+def set_screen_view():
+    """ Resets the GL modelview matrix, for drawing in window coordinates (pixels). """
+    from pyglet import gl
+    gl.glMatrixMode(gl.GL_MODELVIEW)
+    gl.glLoadIdentity()
+
+def screen_to_world(pos, camera=True):
     global WIN_WIDTH
     global WIN_HEIGHT
-    ratio_x = WIN_WIDTH / 2.0
-    ratio_y = WIN_HEIGHT / 2.0
-    x = (pos[0] - ratio_x) / ratio_x
-    y = (pos[1] - ratio_y) / ratio_y
+    center, zoom = _camera(camera)
+    ratio_x = zoom * WIN_WIDTH / 2.0
+    ratio_y = zoom * WIN_HEIGHT / 2.0
+    x = ((pos[0] - (WIN_WIDTH / 2.0)) / ratio_x) + center[0]
+    y = ((pos[1] - (WIN_HEIGHT / 2.0)) / ratio_y) + center[1]
     return (x, y)
 
-def screen_dist_to_world_dist(d):
-    ratio = d / (2 * min(WIN_HEIGHT, WIN_WIDTH))
+def screen_dist_to_world_dist(d, camera=True):
+    ratio = d / (2 * _camera(camera)[1] * min(WIN_HEIGHT, WIN_WIDTH))
     return ratio
 
 def dist(pos1, pos2):